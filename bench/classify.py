@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+# Copyright 2013 John Reese
+# Licensed under the MIT license
+
+"""Compare the throughput of classifying log lines by trying each message
+type's regex in turn, against the combined single-regex classifier."""
+
+import argparse
+import ircstat
+import random
+import time
+
+from ircstat.parser import LogParser
+
+SAMPLE_LINES = [
+    '[12:34:56] <alice> has anyone tried the new build yet?',
+    '[12:34:57] <bob> lol yeah, it works for me',
+    '[12:35:02] <carol> the tests are still failing on my machine though',
+    '[12:35:10] * dave waves hello',
+    '[12:35:11] *** Joins: eve (eve@host.example.com)',
+    '[12:35:40] *** Parts: frank (frank@host.example.com) (later)',
+    '[12:36:01] *** Quits: grace (grace@host.example.com) (Ping timeout)',
+    '[12:36:05] *** bob is now known as bobby',
+    '--- Day changed Sun Jan 01 2023',
+]
+
+# rough share of each sample line in a typical channel log
+SAMPLE_WEIGHTS = [25, 25, 20, 6, 8, 5, 7, 2, 2]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-c', '--config', type=str, default=None,
+                        help='path to config file')
+    parser.add_argument('-n', '--lines', type=int, default=200000,
+                        help='number of log lines to classify')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='number of timing runs, keeping the best')
+
+    return parser.parse_args()
+
+
+def sample_lines(count, seed=42):
+    """Return a deterministic list of sample log lines."""
+    rng = random.Random(seed)
+    return rng.choices(SAMPLE_LINES, SAMPLE_WEIGHTS, k=count)
+
+
+def measure(classify, lines, repeat):
+    """Return the best lines per second seen over a number of runs."""
+    best = None
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for line in lines:
+            classify(line)
+        elapsed = time.perf_counter() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return len(lines) / best
+
+
+def run():
+    args = parse_args()
+    config = ircstat.load_config(args.config)
+    classifier = LogParser(config).classifier
+
+    lines = sample_lines(args.lines)
+
+    before = measure(classifier.classify_each, lines, args.repeat)
+    after = measure(classifier.classify, lines, args.repeat)
+
+    print('one regex at a time: %10.0f lines/s' % before)
+    print('combined regex:      %10.0f lines/s' % after)
+    print('speedup:             %10.2fx' % (after / before))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+
+# Copyright 2013 John Reese
+# Licensed under the MIT license
+
+"""Generate a deterministic set of synthetic IRC logs in the default log
+format, along with a config file whose aliases and ignores match some of the
+generated nicks."""
+
+import argparse
+import datetime
+import os
+import random
+
+from bisect import bisect
+from itertools import accumulate
+from os import path
+
+WORDS = '''
+    the a to of and is it in that you i for on this with be was are have
+    not but what just so like do can if at my me we they no yes about all
+    one get there would how out up now think know good time when more go
+    build test code bug fix release server log patch merge branch deploy
+    lol haha hehe rofl wat yep nope hi hello morning thanks nice cool
+    damn hell shit fuck crap ass
+'''.split()
+
+ACTIONS = ['waves', 'sighs', 'shrugs', 'laughs', 'facepalms',
+           'is away', 'is back', 'grabs coffee']
+
+REASONS = ['', 'later', 'bye', 'Quit: leaving', 'Ping timeout: 240 seconds',
+           'Remote host closed the connection', 'Client Quit']
+
+# lines that don't match any of the default log regexes
+NOISE = ['*** {nick} is now known as {nick}_', '--- Day changed {date}',
+         '*** Topic set by {nick}']
+
+# relative share of each kind of line
+LINE_WEIGHTS = (
+    ('message', 70),
+    ('action', 5),
+    ('join', 8),
+    ('part', 6),
+    ('quit', 8),
+    ('noise', 3),
+)
+
+# suffixes for alternate nicks of the same user, covered by the aliases
+ALIAS_SUFFIXES = ['_', '__', '|away', '|work']
+
+
+def channel_name(index):
+    """Return a channel name made up of only lowercase letters, so that it
+    matches the default filename regex."""
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('a') + remainder) + letters
+
+    return '#chan' + letters
+
+
+def zipf_weights(count, exponent):
+    """Return cumulative weights for picking ranks with a Zipf
+    distribution."""
+    return list(accumulate(1.0 / (rank ** exponent)
+                           for rank in range(1, count + 1)))
+
+
+class LogGenerator(object):
+    """Deterministically generate days of channel logs."""
+
+    def __init__(self, seed=42, users=500, bots=3, ignored=5,
+                 exponent=1.1, alias_rate=0.1):
+        self.rng = random.Random(seed)
+        self.users = ['user%d' % i for i in range(users)]
+        self.bots = ['bot%d' % i for i in range(bots)]
+        self.ignored = ['spam%d' % i for i in range(ignored)]
+        self.alias_rate = alias_rate
+
+        self.nick_weights = zipf_weights(len(self.users), exponent)
+        self.word_weights = zipf_weights(len(WORDS), exponent)
+        self.kinds = [kind for kind, _ in LINE_WEIGHTS]
+        self.kind_weights = list(accumulate(w for _, w in LINE_WEIGHTS))
+
+    def pick(self, items, cum_weights):
+        point = self.rng.random() * cum_weights[-1]
+        return items[bisect(cum_weights, point)]
+
+    def nick(self):
+        roll = self.rng.random()
+
+        if roll < 0.02:
+            return self.rng.choice(self.ignored)
+        if roll < 0.05:
+            return self.rng.choice(self.bots)
+
+        nick = self.pick(self.users, self.nick_weights)
+        if self.rng.random() < self.alias_rate:
+            nick += self.rng.choice(ALIAS_SUFFIXES)
+
+        return nick
+
+    def sentence(self):
+        count = min(int(self.rng.expovariate(0.15)) + 1, 40)
+        return ' '.join(self.pick(WORDS, self.word_weights)
+                        for _ in range(count))
+
+    def line(self, timestamp, date):
+        kind = self.pick(self.kinds, self.kind_weights)
+        nick = self.nick()
+        hostmask = '~%s@%s.example.net' % (nick, nick)
+        reason = self.rng.choice(REASONS)
+
+        if kind == 'message':
+            return '[%s] <%s> %s' % (timestamp, nick, self.sentence())
+        if kind == 'action':
+            return '[%s] * %s %s' % (timestamp, nick,
+                                     self.rng.choice(ACTIONS))
+        if kind == 'join':
+            return '[%s] *** Joins: %s (%s)' % (timestamp, nick, hostmask)
+        if kind == 'part':
+            return '[%s] *** Parts: %s (%s) (%s)' % (timestamp, nick,
+                                                     hostmask, reason)
+        if kind == 'quit':
+            return '[%s] *** Quits: %s (%s) (%s)' % (timestamp, nick,
+                                                     hostmask, reason)
+
+        noise = self.rng.choice(NOISE).format(nick=nick,
+                                              date=date.isoformat())
+        return '[%s] %s' % (timestamp, noise)
+
+    def day(self, date, lines):
+        """Generate the lines of a single day's log, in time order."""
+        seconds = sorted(self.rng.randrange(86400) for _ in range(lines))
+
+        for second in seconds:
+            minutes, second = divmod(second, 60)
+            hours, minutes = divmod(minutes, 60)
+            timestamp = '%02d:%02d:%02d' % (hours, minutes, second)
+            yield self.line(timestamp, date)
+
+    def config(self):
+        """Return the contents of a config file with aliases for the
+        alternate nicks of the most active users, and ignores for spam."""
+        suffixes = '|'.join(suffix.replace('|', r'\|')
+                            for suffix in ALIAS_SUFFIXES)
+        aliases = {r'%s(%s)' % (nick, suffixes): nick
+                   for nick in self.users[:100]}
+
+        return ('aliases = %r\n'
+                'ignore = %r\n'
+                'bots = %r\n'
+                'xkcd_mode = False\n'
+                'parse_cache = False\n'
+                % (aliases, [r'spam\d+'], self.bots))
+
+
+def generate(output_path, channels=4, days=30, lines=2000, seed=42,
+             start=datetime.date(2020, 1, 1), **kwargs):
+    """Write channels x days log files, split into year/month directories,
+    and a config.py file, to the output path.  Returns the total number of
+    log lines written."""
+    generator = LogGenerator(seed=seed, **kwargs)
+    total = 0
+
+    for day in range(days):
+        date = start + datetime.timedelta(days=day)
+        dir_path = path.join(output_path, 'logs', '%04d' % date.year,
+                             '%02d' % date.month)
+        os.makedirs(dir_path, exist_ok=True)
+
+        for index in range(channels):
+            count = max(1, int(generator.rng.gauss(lines, lines / 4)))
+            file_name = '%s_%s.log' % (channel_name(index),
+                                       date.strftime('%Y%m%d'))
+
+            with open(path.join(dir_path, file_name), 'w',
+                      encoding='latin1') as fh:
+                for line in generator.day(date, count):
+                    fh.write(line + '\n')
+
+            total += count
+
+    with open(path.join(output_path, 'config.py'), 'w') as fh:
+        fh.write(generator.config())
+
+    return total
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-c', '--channels', type=int, default=4,
+                        help='number of channels')
+    parser.add_argument('-d', '--days', type=int, default=30,
+                        help='number of days of logs per channel')
+    parser.add_argument('-l', '--lines', type=int, default=2000,
+                        help='average number of lines per log file')
+    parser.add_argument('-u', '--users', type=int, default=500,
+                        help='number of distinct users')
+    parser.add_argument('-s', '--seed', type=int, default=42,
+                        help='random seed')
+    parser.add_argument('output_path',
+                        help='path to write logs and config.py to')
+
+    return parser.parse_args()
+
+
+def run():
+    args = parse_args()
+    total = generate(args.output_path, channels=args.channels,
+                     days=args.days, lines=args.lines, seed=args.seed,
+                     users=args.users)
+    print('wrote %d lines to %s' % (total, args.output_path))
+
+
+if __name__ == '__main__':
+    run()
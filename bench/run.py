@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+
+# Copyright 2013 John Reese
+# Licensed under the MIT license
+
+"""Run the ircstat benchmarks against a generated set of synthetic logs, and
+write the results as JSON so that runs can be compared."""
+
+import argparse
+import gc
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from datetime import datetime
+from os import path
+
+import ircstat
+
+from ircstat.graphs import render_all
+from ircstat.lib import push_config
+from ircstat.parser import LogParser
+from ircstat.plugins import load_plugins, Dispatcher, Plugin
+
+import classify
+import generate
+
+BENCHMARKS = ('classify', 'parse', 'plugins', 'memory', 'render')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-b', '--bench', type=str, action='append',
+                        choices=BENCHMARKS, default=None,
+                        help='benchmark to run, may be repeated '
+                             '(default: all)')
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help='path to write JSON results to')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='number of timing runs, keeping the best')
+    parser.add_argument('-d', '--data', type=str, default=None,
+                        help='path to keep generated logs in, reusing logs '
+                             'already generated there')
+    parser.add_argument('--channels', type=int, default=4,
+                        help='number of channels to generate')
+    parser.add_argument('--days', type=int, default=30,
+                        help='number of days of logs per channel')
+    parser.add_argument('--lines', type=int, default=2000,
+                        help='average number of lines per log file')
+    parser.add_argument('--users', type=int, default=500,
+                        help='number of distinct users')
+    parser.add_argument('--seed', type=int, default=42,
+                        help='random seed for generated logs')
+
+    return parser.parse_args()
+
+
+def best_of(repeat, func):
+    """Call func repeatedly, returning a tuple of the best wall time and the
+    result of the last call."""
+    best = None
+
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best, result
+
+
+def git_revision():
+    here = path.dirname(path.abspath(__file__))
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=here, stderr=subprocess.DEVNULL,
+                                       ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_logs(config, input_paths):
+    push_config(config)
+    parser = LogParser(config)
+    conversations = parser.parse_logs(input_paths)
+    return parser, conversations
+
+
+def bench_classify(config, input_paths, repeat):
+    """Lines per second classified by each regex in turn, and by the combined
+    regex."""
+    classifier = LogParser(config).classifier
+    lines = classify.sample_lines(200000)
+
+    return {
+        'each_lines_per_sec': classify.measure(classifier.classify_each,
+                                               lines, repeat),
+        'combined_lines_per_sec': classify.measure(classifier.classify,
+                                                   lines, repeat),
+    }
+
+
+def bench_parse(config, input_paths, repeat):
+    """Lines per second parsed from the generated logs, in a single process,
+    both as text and memory mapped."""
+    results = {}
+
+    for name, mapped in (('text', False), ('mmap', True)):
+        config.log_mmap = mapped
+        elapsed, (parser, _) = best_of(
+            repeat, lambda: parse_logs(config, input_paths))
+        lines = parser.matched + parser.unmatched
+
+        results[name] = {
+            'seconds': elapsed,
+            'lines': lines,
+            'matched': parser.matched,
+            'unmatched': parser.unmatched,
+            'lines_per_sec': lines / elapsed,
+        }
+
+    config.log_mmap = False
+    return results
+
+
+def bench_plugins(config, input_paths, repeat):
+    """Seconds spent processing the parsed logs by each plugin on its own, and
+    by every plugin together in a single pass."""
+    _, conversations = parse_logs(config, input_paths)
+    results = {}
+
+    for plugin in load_plugins(config):
+        elapsed, _ = best_of(repeat,
+                             lambda: plugin.process(conversations))
+        results[plugin.name] = {'seconds': elapsed}
+
+    dispatcher = Dispatcher(load_plugins(config))
+    elapsed, _ = best_of(repeat, lambda: dispatcher.process(conversations))
+    results['all'] = {'seconds': elapsed}
+
+    return results
+
+
+def bench_memory(config, input_paths, repeat):
+    """Bytes allocated for each plugin's statistics, for each of the
+    statistics backends."""
+    _, conversations = parse_logs(config, input_paths)
+    results = {}
+
+    for backend in sorted(Plugin.stats_backends):
+        config.stats_backend = backend
+        results[backend] = {}
+
+        for plugin in load_plugins(config):
+            gc.collect()
+            tracemalloc.start()
+            network = plugin.process(conversations)
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            results[backend][plugin.name] = {
+                'retained_bytes': current,
+                'peak_bytes': peak,
+                'users': len(network.users),
+            }
+            del network
+
+    config.stats_backend = 'dict'
+    return results
+
+
+def bench_render(config, input_paths, repeat):
+    """Seconds spent rendering every graph in a single process."""
+    _, conversations = parse_logs(config, input_paths)
+    plugin_stats = Dispatcher(load_plugins(config)).process(conversations)
+
+    graphs = []
+    for plugin, network in plugin_stats.items():
+        for graph in plugin.generate_graphs():
+            graph.prep(plugin, config, network)
+            graphs.append(graph)
+
+    with tempfile.TemporaryDirectory() as output_path:
+        elapsed, _ = best_of(repeat,
+                             lambda: render_all(graphs, output_path, 1))
+
+    return {
+        'seconds': elapsed,
+        'graphs': len(graphs),
+        'graphs_per_sec': len(graphs) / elapsed,
+    }
+
+
+def run():
+    args = parse_args()
+    benchmarks = args.bench or BENCHMARKS
+
+    with tempfile.TemporaryDirectory() as temp_path:
+        data_path = args.data or temp_path
+        config_path = path.join(data_path, 'config.py')
+
+        if not path.isfile(config_path):
+            lines = generate.generate(data_path, channels=args.channels,
+                                      days=args.days, lines=args.lines,
+                                      seed=args.seed, users=args.users)
+            print('generated %d lines of logs' % lines, file=sys.stderr)
+
+        config = ircstat.load_config(config_path)
+        config.parse_jobs = 1
+        input_paths = [path.join(data_path, 'logs')]
+
+        results = {}
+        for name in benchmarks:
+            print('running %s benchmark' % name, file=sys.stderr)
+            bench = globals()['bench_' + name]
+            results[name] = bench(config, input_paths, args.repeat)
+
+    report = {
+        'version': ircstat.VERSION,
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': datetime.now().isoformat(),
+        'parameters': {
+            'channels': args.channels,
+            'days': args.days,
+            'lines': args.lines,
+            'users': args.users,
+            'seed': args.seed,
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            fh.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    run()
@@ -4,5 +4,6 @@
 # flake8: noqa
 
 from .core import VERSION, do_everything
+from .export import EXPORT_FORMATS
 from .log import logger
 from .config import load_config
@@ -0,0 +1,150 @@
+# Copyright 2013 John Reese
+# Licensed under the MIT license
+
+import hashlib
+import os
+import pickle
+
+from os import path
+
+from .ent import Struct
+from .lib import atomic_write
+from .log import logger
+
+log = logger(__name__)
+
+# bump this whenever the format of cached entries changes
+CACHE_VERSION = 2
+
+# configuration values that affect the results of parsing a log file
+CACHE_SETTINGS = (
+    'log_message_regex',
+    'log_action_regex',
+    'log_join_regex',
+    'log_part_regex',
+    'log_quit_regex',
+    'log_timestamp_format',
+    'log_timestamp_seconds',
+    'log_encoding',
+    'log_mmap',
+    'aliases',
+    'ignore',
+)
+
+
+def normalize(value):
+    """Convert a configuration value into a form with a stable repr()."""
+    if isinstance(value, Struct):
+        value = value.__dict__
+
+    if isinstance(value, dict):
+        return sorted((k, normalize(v)) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        return [normalize(v) for v in value]
+    elif isinstance(value, set):
+        return sorted(normalize(v) for v in value)
+
+    return value
+
+
+def settings_hash(config, names=CACHE_SETTINGS, version=CACHE_VERSION):
+    """Generate a hash of the given configuration values, by default using
+    every value that may change the messages parsed from a log file."""
+    settings = [version]
+
+    for name in names:
+        settings.append((name, normalize(getattr(config, name))))
+
+    return hashlib.sha1(repr(settings).encode('utf-8')).hexdigest()
+
+
+class ParseCache(Struct):
+    """Store the parsed contents of log files on disk as pickled
+    MessageColumns objects, keyed by the path, modification time and size of
+    each log file, along with a hash of the parsing configuration.  Cached
+    entries are evicted in least recently used order once the cache grows
+    larger than the configured size."""
+    def __init__(self, config):
+        Struct.__init__(self,
+                        path=path.expanduser(config.parse_cache_path),
+                        limit=config.parse_cache_size * 1024 * 1024,
+                        settings=settings_hash(config),
+                        )
+
+    def entry_path(self, file_path):
+        """Return the path of the cache entry for the given log file, or None
+        if the log file can't be examined."""
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return None
+
+        key = repr((path.realpath(file_path), st.st_mtime_ns, st.st_size,
+                    self.settings))
+        key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+        return path.join(self.path, key)
+
+    def load(self, file_path):
+        """Return a tuple of (messages, matched, unmatched) for the given log
+        file, or None if the log file has no valid cache entry."""
+        entry_path = self.entry_path(file_path)
+        if entry_path is None or not path.isfile(entry_path):
+            return None
+
+        try:
+            with open(entry_path, 'rb') as fh:
+                matched, unmatched, messages = pickle.load(fh)
+            os.utime(entry_path)
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            log.debug('ignoring unreadable cache entry "%s"', entry_path)
+            return None
+
+        log.debug('loaded log file "%s" from cache', file_path)
+
+        return messages, matched, unmatched
+
+    def store(self, file_path, messages, matched, unmatched):
+        """Save the parsed messages and line counts for the given log file."""
+        entry_path = self.entry_path(file_path)
+        if entry_path is None:
+            return
+
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            with atomic_write(entry_path, 'wb') as fh:
+                pickle.dump((matched, unmatched, messages), fh,
+                            pickle.HIGHEST_PROTOCOL)
+        except OSError as e:
+            log.debug('failed to cache log file "%s": %s', file_path, e)
+
+    def prune(self):
+        """Evict the least recently used entries until the total size of the
+        cache fits within the configured limit."""
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return
+
+        entries = []
+        for name in names:
+            try:
+                st = os.stat(path.join(self.path, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        entries.sort()
+
+        for _, size, name in entries:
+            if total <= self.limit:
+                break
+
+            try:
+                os.remove(path.join(self.path, name))
+                total -= size
+            except OSError:
+                continue
+
+        log.debug('parse cache holds %d bytes', total)
@@ -5,39 +5,151 @@ VERSION = '0.1.1'
 
 import os
 
+from collections import defaultdict
 from os import path
 
+from .export import export_stats
+from .graphs import render_graphs
 from .log import logger
 from .lib import push_config
 from .parser import LogParser
-from .plugins import load_plugins
+from .plugins import load_plugins, Dispatcher
+from .profiling import Profiler
+from .snapshot import Snapshot
 
 log = logger(__name__)
 
 
+def process_logs(parser, dispatcher, input_paths, profiler):
+    """Parse every log file up front, then process the entire set of
+    conversations with the plugins.  Returns the mapping of plugins to their
+    NetworkStat objects, and the number of conversations per channel."""
+    with profiler.stage('find logs'):
+        logs = list(parser.find_logs(input_paths))
+
+    with profiler.stage('parse'):
+        conversations = parser.parse_all(logs)
+
+    counts = {channel: len(conversations[channel])
+              for channel in conversations}
+
+    with profiler.stage('process'):
+        return dispatcher.process(conversations), counts
+
+
+def stream_logs(parser, dispatcher, input_paths, profiler):
+    """Process each conversation with the plugins as soon as its log file is
+    parsed, and then discard it, so that only a single conversation is held
+    in memory at a time.  Returns the same values as process_logs()."""
+    counts = defaultdict(int)
+
+    with profiler.stage('find logs'):
+        logs = list(parser.find_logs(input_paths))
+
+    with profiler.stage('parse and process'):
+        dispatcher.start()
+
+        for conversation in parser.parse_files(logs):
+            counts[conversation.channel] += 1
+            dispatcher.feed(conversation)
+
+        return dispatcher.finish(), counts
+
+
+def update_logs(parser, dispatcher, snapshot, input_paths, profiler):
+    """Continue from the statistics saved in a previous run's snapshot,
+    removing days whose log files were changed or removed, and processing only
+    log files that are new or changed, before saving a new snapshot.  Returns
+    the same values as process_logs()."""
+    with profiler.stage('find logs'):
+        logs = list(parser.find_logs(input_paths))
+
+    with profiler.stage('load snapshot'):
+        saved = snapshot.load(dispatcher.plugins)
+        previous, networks = saved if saved is not None else ({}, None)
+
+        fingerprints, stale, fresh = snapshot.changes(logs, previous)
+        log.info('processing %d new or changed log files', len(fresh))
+
+        periods = {period: snapshot.period_logs(logs, stale, fresh, period)
+                   for period in dispatcher.removal_periods()}
+
+    with profiler.stage('parse and process'):
+        dispatcher.start(networks)
+
+        for channel, date in stale:
+            dispatcher.remove_day(channel, date)
+
+        for conversation in parser.parse_files(fresh):
+            dispatcher.feed(conversation)
+
+        for period, period_logs in periods.items():
+            log.debug('processing %d unchanged log files again for plugins '
+                      'that remove whole periods', len(period_logs))
+            for conversation in parser.parse_files(period_logs):
+                dispatcher.feed_period(conversation, period)
+
+        plugin_stats = dispatcher.finish()
+
+    with profiler.stage('save snapshot'):
+        snapshot.save(fingerprints, plugin_stats)
+
+    counts = defaultdict(int)
+    for channel, date in fingerprints:
+        counts[channel] += 1
+
+    return plugin_stats, counts
+
+
+def render_output(plugin_stats, output_path, config, profiler):
+    """Prepare every plugin's graphs, and render them to the output path."""
+    with profiler.stage('prepare graphs'):
+        graphs = []
+        for plugin, result in plugin_stats.items():
+            for graph in plugin.generate_graphs():
+                log.debug(graph)
+                graph.prep(plugin, config, result)
+                graphs.append(graph)
+
+    with profiler.stage('render graphs'):
+        render_graphs(graphs, output_path, config.graph_jobs,
+                      config.force_render)
+
+
 def do_everything(input_paths, output_path, config):
     """One entry point to rule them all."""
     push_config(config)
+    profiler = Profiler(config.profile)
 
-    parser = LogParser(config)
-    conversations = parser.parse_logs(input_paths)
-
-    log.info('found %d channels', len(conversations))
-    for channel in conversations:
-        log.info('channel %s has %d conversations', channel,
-                 len(conversations[channel]))
+    with profiler.stage('setup'):
+        parser = LogParser(config)
+        plugins = load_plugins(config)
+        dispatcher = Dispatcher(plugins, profiler.plugin_timings())
 
     if not path.exists(output_path):
         os.makedirs(output_path)
 
-    plugins = load_plugins(config)
-    plugin_stats = {}
+    if config.incremental:
+        snapshot = Snapshot(config, output_path)
+        plugin_stats, counts = update_logs(parser, dispatcher, snapshot,
+                                           input_paths, profiler)
+    elif config.parse_streaming:
+        plugin_stats, counts = stream_logs(parser, dispatcher, input_paths,
+                                           profiler)
+    else:
+        plugin_stats, counts = process_logs(parser, dispatcher, input_paths,
+                                            profiler)
+
+    log.info('found %d channels', len(counts))
+    for channel in counts:
+        log.info('channel %s has %d conversations', channel, counts[channel])
+
+    if config.export_format:
+        with profiler.stage('export'):
+            export_stats(plugin_stats, output_path, config.export_format)
 
-    for plugin in plugins:
-        result = plugin.process(conversations)
-        plugin_stats[plugin] = result
+    if config.graph_output:
+        render_output(plugin_stats, output_path, config, profiler)
 
-        for graph in plugin.generate_graphs():
-            log.debug(graph)
-            graph.prep(plugin, config, result)
-            graph.render(output_path)
+    if config.profile:
+        profiler.save(profiler.report(parser), output_path)
@@ -9,6 +9,8 @@
 # must contain two named matching groups:
 #   channel: the name of the channel
 #   date: the date of the conversation
+# log files compressed with gzip, bzip2 or xz are read directly, and their
+# .gz, .bz2 or .xz extension is removed before matching against this regex
 filename_regex = r'(?P<channel>#?[a-z]+)_(?P<date>\d{8}).log'
 
 # the format of the date content in the matched filename.
@@ -16,6 +18,17 @@ filename_regex = r'(?P<channel>#?[a-z]+)_(?P<date>\d{8}).log'
 # http://docs.python.org/2/library/datetime.html#strftime-strptime-behavior
 filename_date_format = r'%Y%m%d'
 
+# only process log files whose filename date falls within this window
+# each end is a 'YYYY-MM-DD' string, or None to leave that end unbounded
+# files outside the window are never opened, and directories named after a
+# year from 1900 to 2099 or a month outside the window, such as 2014/ or
+# 2014/03/, are skipped
+log_since = None
+log_until = None
+
+# when log_since is None, only process log files from the last graph_days days
+log_since_graph_days = False
+
 # character encoding used by the log files
 # 'latin1' is the default, but 'utf-8' is probably a good fallback
 log_encoding = 'latin1'
@@ -76,6 +89,55 @@ log_message_regex = r'%s <%s> (?P<content>.*)' % (timestamp_regex, nick_regex)
 # http://docs.python.org/2/library/datetime.html#strftime-strptime-behavior
 log_timestamp_format = r'%H:%M:%S'
 
+# store message timestamps as an integer number of seconds since midnight,
+# rather than as datetime.time objects
+log_timestamp_seconds = False
+
+# memory map uncompressed log files and match the log regexes against raw
+# bytes, decoding only the captured fields of messages that are kept
+# requires an encoding compatible with ascii, such as latin1 or utf-8
+# note: \w, \s and similar classes only match ascii characters in this mode
+# note: this is not generally faster; in bench/run.py -b parse it is about 10%
+# slower than the text parser on the default synthetic logs, and only a few
+# percent faster on single log files of tens of megabytes
+log_mmap = False
+
+# number of worker processes used to parse log files in parallel
+# None will use one process per available cpu core, and 1 will parse
+# every log file within the main process
+parse_jobs = None
+
+# process each log file with the plugins as soon as it has been parsed,
+# rather than holding every parsed conversation in memory at once
+# note: if multiple log files match the same channel and date, streaming
+# will process all of them, rather than only the last file found
+parse_streaming = False
+
+# cache the parsed contents of each log file on disk, so that log files that
+# haven't changed don't need to be parsed again on later runs
+parse_cache = True
+
+# directory used to store the parse cache
+parse_cache_path = '~/.cache/ircstat'
+
+# maximum size of the parse cache, in megabytes
+# once the cache grows beyond this size, the least recently used entries
+# will be removed from the cache
+parse_cache_size = 512
+
+# record the time spent in each stage of a run and in each plugin, along with
+# parsing and memory statistics, and write them to ircstat.profile.json in the
+# output path
+# note: nick cache hits and misses are totalled across parsing worker
+# processes, while cache sizes are the largest within any single process
+profile = False
+
+# save each plugin's statistics to a snapshot in the output path, and on later
+# runs, only process log files that are new or changed since the snapshot
+# note: changing any parsing, bot or plugin options will cause the next run
+# to process every log file again
+incremental = False
+
 
 ######################
 # User/nick options
@@ -106,6 +168,23 @@ image_format = 'png'
 # enable matplotlib's XKCD mode, where graphs will look hand-drawn
 xkcd_mode = True
 
+# render graphs to image files in the output path
+# when disabled, matplotlib doesn't need to be installed or imported
+graph_output = True
+
+# also write each plugin's statistics to structured files in the output path
+# one of 'json' or 'csv', or None to only render graphs
+export_format = None
+
+# number of worker processes used to render graphs in parallel
+# None will use one process per available cpu core, and 1 will render
+# every graph within the main process
+graph_jobs = None
+
+# render every graph, even if its data and options are unchanged since the
+# image in the output path was last rendered
+force_render = False
+
 # for time-series graphs, how many days back should the graphs show
 graph_days = 180
 
@@ -121,3 +200,20 @@ graph_users = 10
 # must be an iterable containing strings of plugin names,
 # without the 'Plugin' suffix
 plugin_blacklist = []
+
+# options for individual plugins are set as attributes of plugins.<name>
+# for example, the Uniques plugin estimates distinct active users with
+# sketches of 2 ** precision bytes each, with a relative standard error of
+# 1.04 / sqrt(2 ** precision), or about 1.6% for the default of 12:
+#   plugins.Uniques.precision = 14
+# and the Vocabulary plugin tracks the most used words with a sketch of
+# width * depth * 4 bytes for each channel and month, optionally for every
+# user as well:
+#   plugins.Vocabulary.width = 2048
+#   plugins.Vocabulary.user_words = True
+
+# how plugins store their statistics
+#   'dict': nested dictionaries of counters, allowing any numeric values
+#   'array': dense arrays of integer counters, using less memory for large
+#            networks with many users and days
+stats_backend = 'dict'
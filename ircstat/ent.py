@@ -1,7 +1,16 @@
 # Copyright 2013 John Reese
 # Licensed under the MIT license
 
+import heapq
+import sys
+
+from array import array
 from collections import defaultdict
+from datetime import time
+from functools import lru_cache, partial
+from itertools import repeat
+
+from .lib import month, week
 
 safe_types = (bool, int, float, str, tuple, list, dict, set)
 
@@ -81,8 +90,106 @@ class Message(Struct):
                         hostmask=hostmask)
 
 
+@lru_cache(maxsize=None)
+def seconds_to_time(seconds):
+    """Convert a number of seconds since midnight into a time object."""
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return time(hours, minutes, seconds)
+
+
+class MessageView(object):
+    """A lightweight view of a single message from a MessageColumns object,
+    with the same attributes as a Message object."""
+    __slots__ = ('type', 'time', 'nick', 'content', 'reason', 'hostmask')
+
+    def __init__(self, type, time, nick, content, reason, hostmask):
+        self.type = type
+        self.time = time
+        self.nick = nick
+        self.content = content
+        self.reason = reason
+        self.hostmask = hostmask
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__,
+                            {k: getattr(self, k) for k in self.__slots__})
+
+
+class MessageColumns(Struct):
+    """Store an ordered list of messages column-wise, rather than as one
+    Message object per message.  Message types and timestamps are kept in
+    arrays, with timestamps as whole seconds since midnight, and nicks are
+    interned and referred to by index.  Iterating produces a MessageView for
+    each message, with timestamps as time objects unless seconds is True."""
+    def __init__(self, seconds=False):
+        Struct.__init__(self,
+                        seconds=seconds,
+                        types=array('B'),
+                        times=array('l'),
+                        nick_ids=array('L'),
+                        nicks=[],
+                        contents=[],
+                        reasons=[],
+                        hostmasks=[],
+                        nick_index={},
+                        )
+
+    def __repr__(self):
+        return '<%s (%d messages)>' % (self.__class__.__name__, len(self))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['nick_index']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.nick_index = {nick: i for i, nick in enumerate(self.nicks)}
+
+    def __len__(self):
+        return len(self.types)
+
+    def __iter__(self):
+        times = self.times
+        if not self.seconds:
+            times = map(seconds_to_time, times)
+
+        for values in zip(self.types, times,
+                          map(self.nicks.__getitem__, self.nick_ids),
+                          self.contents, self.reasons, self.hostmasks):
+            yield MessageView(*values)
+
+    def __getitem__(self, index):
+        seconds = self.times[index]
+
+        return MessageView(self.types[index],
+                           seconds if self.seconds else
+                           seconds_to_time(seconds),
+                           self.nicks[self.nick_ids[index]],
+                           self.contents[index],
+                           self.reasons[index],
+                           self.hostmasks[index])
+
+    def append(self, type, time, nick, content=None, reason=None,
+               hostmask=None):
+        """Add a message, with the time given as seconds since midnight."""
+        nick_id = self.nick_index.get(nick)
+        if nick_id is None:
+            nick_id = self.nick_index[nick] = len(self.nicks)
+            self.nicks.append(sys.intern(nick))
+
+        self.types.append(type)
+        self.times.append(time)
+        self.nick_ids.append(nick_id)
+        self.contents.append(content)
+        self.reasons.append(reason)
+        self.hostmasks.append(hostmask)
+
+
 class Conversation(Struct):
-    """Store an ordered list of messages for a single day and channel."""
+    """Store an ordered list of messages for a single day and channel, either
+    as a list of Message objects, or as a MessageColumns object."""
     def __init__(self, channel, date, messages=None):
         if messages is None:
             messages = []
@@ -92,6 +199,215 @@ class Conversation(Struct):
                         messages=messages)
 
 
+class StatCounters(object):
+    """Mixin for statistics objects that count key/value pairs, both for the
+    object as a whole, and for a set of users."""
+
+    def inc(self, values):
+        """Increment counters for an iterable of key/value pairs, as
+        returned by the network's prepare() method."""
+        stats = self.stats
+        for key, value in values:
+            stats[key] += value
+
+    def inc_user(self, nick, values):
+        """Increment a single user's counters for an iterable of key/value
+        pairs, as returned by the network's prepare() method."""
+        stats = self.users[nick].stats
+        for key, value in values:
+            stats[key] += value
+
+    def merge(self, other):
+        """Add every counter and sketch from another statistics object."""
+        self.merge_stats(other)
+        self.merge_users(other)
+        self.merge_sketches(other)
+
+    def merge_stats(self, other):
+        """Add the counters for the object as a whole from another statistics
+        object."""
+        self.inc(other.stats.items())
+
+    def merge_users(self, other):
+        """Add every user's counters from another statistics object."""
+        for nick, user in other.users.items():
+            self.inc_user(nick, user.stats.items())
+
+
+class StatSketches(object):
+    """Mixin for statistics objects that estimate the number of distinct
+    values seen for a set of keys, using a mergeable sketch for each key,
+    such as a HyperLogLog object, rather than keeping every value."""
+
+    def sketch(self, key, factory):
+        """Return the sketch for the given key, creating it from the given
+        factory if needed."""
+        sketch = self.sketches.get(key)
+        if sketch is None:
+            sketch = self.sketches[key] = factory()
+        return sketch
+
+    def distinct(self, key):
+        """Return the estimated number of distinct values for the given key,
+        or zero if nothing has been counted."""
+        sketch = self.sketches.get(key)
+        return 0 if sketch is None else sketch.count()
+
+    def merge_sketches(self, other):
+        """Merge every sketch from another statistics object, copying any
+        sketch for a key that this object doesn't have yet."""
+        self.merge_sketch_map(other.sketches)
+
+    def merge_sketch_map(self, sketches):
+        """Merge every sketch from a mapping of keys to sketches."""
+        for key, sketch in sketches.items():
+            mine = self.sketches.get(key)
+            if mine is None:
+                self.sketches[key] = sketch.copy()
+            else:
+                mine.merge(sketch)
+
+
+class Rollups(object):
+    """Mixin for statistics objects whose counters are summed from a set of
+    smaller statistics objects the first time they are read, rather than
+    being counted as messages are processed.  Summed values are remembered
+    until invalidate() is called.  Subclasses must provide the parts() and
+    new_scope() methods."""
+
+    @property
+    def users(self):
+        return self.totals('users').users
+
+    @property
+    def stats(self):
+        return self.totals('stats').stats
+
+    @property
+    def sketches(self):
+        return self.totals('sketches').sketches
+
+    def distinct(self, key):
+        sketch = self.sketches.get(key)
+        return 0 if sketch is None else sketch.count()
+
+    def __getstate__(self):
+        return {key: value for key, value in self.__dict__.items()
+                if not key.startswith('_rollup_')}
+
+    def rollup(self, name, compute):
+        """Return a remembered value, computing it first if needed."""
+        name = '_rollup_' + name
+        value = self.__dict__.get(name)
+
+        if value is None:
+            value = self.__dict__[name] = compute()
+
+        return value
+
+    def invalidate(self):
+        """Forget every summed value, after the smaller scopes change."""
+        for key in list(self.__dict__):
+            if key.startswith('_rollup_'):
+                del self.__dict__[key]
+
+    def totals(self, part):
+        """Return a statistics object summing one part of every smaller
+        scope, either 'stats', 'users' or 'sketches'.  Each part is summed
+        separately, so that reading one never pays for summing the others."""
+        return self.rollup(part, lambda: self.sum_scopes(self.parts(),
+                                                         self.new_scope,
+                                                         'merge_' + part))
+
+    def rankings(self, size):
+        """Return a mapping of each key to a list of up to size (nick, value)
+        pairs for the users with the largest non-zero values, largest first.
+        Every key is ranked in a single pass over the users, and the result
+        is remembered like any other rollup."""
+        return self.rollup('rankings_%d' % size,
+                           lambda: self.rank_users(self.users, size))
+
+    @staticmethod
+    def rank_users(users, size):
+        """Rank the users by each of their keys, keeping only the top users
+        for each key, with ties broken by nick."""
+        values = defaultdict(list)
+        for nick, user in users.items():
+            for key, value in user.stats.items():
+                if value:
+                    values[key].append((-value, nick))
+
+        return {key: [(nick, -value) for value, nick
+                      in heapq.nsmallest(size, pairs)]
+                for key, pairs in values.items()}
+
+    @staticmethod
+    def sum_scopes(scopes, factory, method='merge'):
+        """Merge a set of statistics objects into a new object, using the
+        named merge method."""
+        total = factory()
+        for scope in scopes:
+            getattr(total, method)(scope)
+        return total
+
+
+class ChannelRollups(Rollups):
+    """Mixin for channel statistics objects, where the channel, weekly and
+    monthly statistics are summed from the daily statistics.  Sketches may
+    also be counted directly for a whole month, in month_sketches, when
+    keeping them for every day would use too much memory; these are merged
+    into the monthly and channel sketches, but not the weekly sketches."""
+
+    @property
+    def weeks(self):
+        return self.rollup('weeks', lambda: self.group_days(week,
+                                                            self.new_week))
+
+    @property
+    def months(self):
+        return self.rollup('months', self.group_months)
+
+    @property
+    def sketches(self):
+        return self.rollup('sketches', self.sum_sketches).sketches
+
+    def parts(self):
+        return self.days.values()
+
+    def month_sketch(self, date, key, factory):
+        """Return the sketch for the given key for the whole month of the
+        given date, creating it from the given factory if needed."""
+        sketches = self.month_sketches.setdefault(month(date), {})
+        sketch = sketches.get(key)
+        if sketch is None:
+            sketch = sketches[key] = factory()
+        return sketch
+
+    def group_months(self):
+        """Sum the daily statistics into months, along with the sketches
+        counted for whole months."""
+        groups = self.group_days(month, self.new_month)
+        for date, sketches in self.month_sketches.items():
+            groups[date].merge_sketch_map(sketches)
+        return groups
+
+    def sum_sketches(self):
+        """Merge the daily sketches and those counted for whole months."""
+        total = self.sum_scopes(self.parts(), self.new_scope,
+                                'merge_sketches')
+        for sketches in self.month_sketches.values():
+            total.merge_sketch_map(sketches)
+        return total
+
+    def group_days(self, bucket, factory):
+        """Sum the daily statistics into groups, keyed by the date returned
+        from the given bucket function."""
+        groups = defaultdict(factory)
+        for date, day in self.days.items():
+            groups[bucket(date)].merge(day)
+        return groups
+
+
 class UserStat(Struct):
     """Store key/value pairs for a single user."""
     def __init__(self):
@@ -99,47 +415,241 @@ class UserStat(Struct):
                         stats=defaultdict(int))
 
 
-class DailyStat(Struct):
-    """Store key/value pairs for the day, and for a set of users."""
+class ScopeStat(StatCounters, StatSketches, Struct):
+    """Store key/value pairs for some period of time, and for a set of
+    users, along with sketches of distinct values."""
     def __init__(self):
         Struct.__init__(self,
                         users=defaultdict(UserStat),
-                        stats=defaultdict(int))
+                        stats=defaultdict(int),
+                        sketches={})
+
+
+class DailyStat(ScopeStat):
+    """Store key/value pairs for the day, and for a set of users."""
 
 
-class WeeklyStat(Struct):
+class WeeklyStat(ScopeStat):
     """Store key/value pairs for a week, and for a set of users."""
-    def __init__(self):
-        Struct.__init__(self,
-                        users=defaultdict(UserStat),
-                        stats=defaultdict(int))
 
 
-class MonthlyStat(Struct):
+class MonthlyStat(ScopeStat):
     """Store key/value pairs for a month, and for a set of users."""
-    def __init__(self):
-        Struct.__init__(self,
-                        users=defaultdict(UserStat),
-                        stats=defaultdict(int))
 
 
-class ChannelStat(Struct):
+class ChannelStat(ChannelRollups, Struct):
     """Store key/value pairs for a given channel, a set of days, and for
-    a set of users."""
+    a set of users.  Only the daily statistics are counted directly; weekly,
+    monthly and channel statistics are summed from them when read."""
+    new_scope = ScopeStat
+    new_week = WeeklyStat
+    new_month = MonthlyStat
+
     def __init__(self):
         Struct.__init__(self,
-                        users=defaultdict(UserStat),
                         days=defaultdict(DailyStat),
-                        weeks=defaultdict(WeeklyStat),
-                        months=defaultdict(MonthlyStat),
-                        stats=defaultdict(int))
+                        month_sketches={})
 
 
-class NetworkStat(Struct):
+class NetworkStat(Rollups, Struct):
     """Store key/value pairs for a network, a set of channels, and for
-    a set of users."""
+    a set of users.  Network statistics are summed from the channel
+    statistics when read."""
+    new_scope = ScopeStat
+
     def __init__(self):
         Struct.__init__(self,
-                        channels=defaultdict(ChannelStat),
-                        users=defaultdict(UserStat),
-                        stats=defaultdict(int))
+                        channels=defaultdict(ChannelStat))
+
+    def parts(self):
+        return self.channels.values()
+
+    @staticmethod
+    def prepare(values):
+        """Convert a dictionary of key/value pairs into the form expected
+        by the inc() and inc_user() methods."""
+        return values.items()
+
+
+class KeyIndex(Struct):
+    """Assign dense integer ids to statistics keys, shared by every
+    ArrayStats object within an ArrayNetworkStat."""
+    def __init__(self):
+        Struct.__init__(self,
+                        ids={},
+                        keys=[],
+                        )
+
+    def id(self, key):
+        """Return the id for the given key, assigning a new id if needed."""
+        key_id = self.ids.get(key)
+        if key_id is None:
+            key_id = self.ids[key] = len(self.keys)
+            self.keys.append(key)
+        return key_id
+
+
+class ArrayStats(object):
+    """A dictionary-like set of integer counters, stored in a dense array
+    indexed by the ids from a shared KeyIndex.  Missing keys count as zero,
+    and counters that are zero are treated as missing, so that iterating
+    only sees the same keys a dictionary of the counts would hold."""
+    __slots__ = ('index', 'counters')
+
+    def __init__(self, index):
+        self.index = index
+        self.counters = array('q')
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, dict(self.items()))
+
+    def __getitem__(self, key):
+        key_id = self.index.ids.get(key)
+        if key_id is None or key_id >= len(self.counters):
+            return 0
+        return self.counters[key_id]
+
+    def __setitem__(self, key, value):
+        key_id = self.index.id(key)
+        self.grow(key_id + 1)
+        self.counters[key_id] = value
+
+    def __delitem__(self, key):
+        if key in self:
+            self.counters[self.index.ids[key]] = 0
+
+    def __contains__(self, key):
+        return self[key] != 0
+
+    def __iter__(self):
+        return (key for key, value in zip(self.index.keys, self.counters)
+                if value)
+
+    def __len__(self):
+        return len(self.counters) - self.counters.count(0)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [value for value in self.counters if value]
+
+    def items(self):
+        return [(key, value) for key, value in
+                zip(self.index.keys, self.counters) if value]
+
+    def grow(self, size):
+        """Extend the array with zeros to hold at least the given size."""
+        if len(self.counters) < size:
+            self.counters.extend(repeat(0, size - len(self.counters)))
+
+    def add(self, values):
+        """Add an iterable of (key id, value) pairs to the counters."""
+        counters = self.counters
+        if len(counters) < len(self.index.keys):
+            self.grow(len(self.index.keys))
+
+        for key_id, value in values:
+            counters[key_id] += value
+
+
+class ArrayUserStat(object):
+    """Store key/value pairs for a single user in an ArrayStats object."""
+    __slots__ = ('stats',)
+
+    def __init__(self, index):
+        self.stats = ArrayStats(index)
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.stats)
+
+
+class ArrayScopeStat(StatSketches, Struct):
+    """Store key/value pairs for some period of time, and for a set of users,
+    using ArrayStats objects rather than dictionaries, along with sketches of
+    distinct values."""
+    def __init__(self, index):
+        Struct.__init__(self,
+                        users=defaultdict(partial(ArrayUserStat, index)),
+                        stats=ArrayStats(index),
+                        sketches={})
+
+    def inc(self, values):
+        """Increment counters for a list of (key id, value) pairs, as
+        returned by the network's prepare() method."""
+        self.stats.add(values)
+
+    def inc_user(self, nick, values):
+        """Increment a single user's counters for a list of (key id, value)
+        pairs, as returned by the network's prepare() method."""
+        stats = self.users[nick].stats
+        counters = stats.counters
+        if len(counters) < len(stats.index.keys):
+            stats.grow(len(stats.index.keys))
+
+        for key_id, value in values:
+            counters[key_id] += value
+
+    def merge(self, other):
+        """Add every counter and sketch from another array-backed statistics
+        object."""
+        self.merge_stats(other)
+        self.merge_users(other)
+        self.merge_sketches(other)
+
+    def merge_stats(self, other):
+        """Add the counters for the object as a whole from another
+        array-backed statistics object."""
+        self.inc(enumerate(other.stats.counters))
+
+    def merge_users(self, other):
+        """Add every user's counters from another array-backed statistics
+        object."""
+        for nick, user in other.users.items():
+            self.inc_user(nick, enumerate(user.stats.counters))
+
+
+class ArrayChannelStat(ChannelRollups, Struct):
+    """Store key/value pairs for a given channel, a set of days, and for a
+    set of users, using ArrayStats objects rather than dictionaries."""
+    def __init__(self, index):
+        Struct.__init__(self,
+                        index=index,
+                        days=defaultdict(partial(ArrayScopeStat, index)),
+                        month_sketches={})
+
+    def new_scope(self):
+        return ArrayScopeStat(self.index)
+
+    new_week = new_month = new_scope
+
+
+class ArrayNetworkStat(Rollups, Struct):
+    """Store key/value pairs for a network, a set of channels, and for a set
+    of users, giving every key a dense integer id and counting values in
+    arrays rather than dictionaries.  The attributes and read access match
+    NetworkStat, but only integer values may be counted."""
+    def __init__(self):
+        index = KeyIndex()
+        Struct.__init__(self,
+                        index=index,
+                        channels=defaultdict(partial(ArrayChannelStat, index)))
+
+    def parts(self):
+        return self.channels.values()
+
+    def new_scope(self):
+        return ArrayScopeStat(self.index)
+
+    def prepare(self, values):
+        """Convert a dictionary of key/value pairs into a list of (key id,
+        value) pairs, as expected by the inc() and inc_user() methods."""
+        ids = self.index.ids
+        try:
+            return [(ids[key], value) for key, value in values.items()]
+        except KeyError:
+            key_id = self.index.id
+            return [(key_id(key), value) for key, value in values.items()]
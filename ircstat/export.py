@@ -0,0 +1,155 @@
+# Copyright 2013 John Reese
+# Licensed under the MIT license
+
+import csv
+import json
+
+from os import path
+
+from .lib import atomic_write
+from .log import logger
+
+log = logger(__name__)
+
+EXPORT_FORMATS = ('json', 'csv')
+
+
+def sketch_key(key):
+    """Split a sketch key into its name and nick, where per-user sketches are
+    keyed by a (name, nick) tuple, and other sketches by name alone."""
+    if isinstance(key, tuple):
+        return key
+    return key, ''
+
+
+def stat_values(stats):
+    """Return the (key, value) pairs of a set of stats, leaving out values of
+    zero, which both stats backends treat the same as missing values."""
+    return [(key, value) for key, value in stats.items() if value]
+
+
+def scope_dict(scope):
+    """Convert the totals and per-user values of a single scope into plain
+    dictionaries, along with summaries of any sketches."""
+    result = {
+        'stats': dict(stat_values(scope.stats)),
+        'users': {nick: dict(stat_values(user.stats))
+                  for nick, user in scope.users.items()},
+    }
+
+    for key, sketch in scope.sketches.items():
+        name, nick = sketch_key(key)
+        if nick:
+            sketches = result.setdefault('user_sketches', {})
+            sketches = sketches.setdefault(nick, {})
+        else:
+            sketches = result.setdefault('sketches', {})
+        sketches[name] = sketch.summary()
+
+    return result
+
+
+def scope_periods(scopes):
+    """Convert a mapping of dates to scopes into a dictionary keyed by the
+    ISO formatted dates."""
+    return {date.isoformat(): scope_dict(scope)
+            for date, scope in sorted(scopes.items())}
+
+
+def network_dict(network):
+    """Convert the entire hierarchy of a plugin's network statistics into
+    plain dictionaries, including channel totals along with daily, weekly
+    and monthly values for each channel."""
+    result = scope_dict(network)
+    result['channels'] = {}
+
+    for name, channel in sorted(network.channels.items()):
+        data = scope_dict(channel)
+        data['days'] = scope_periods(channel.days)
+        data['weeks'] = scope_periods(channel.weeks)
+        data['months'] = scope_periods(channel.months)
+        result['channels'][name] = data
+
+    return result
+
+
+def summary_values(name, summary):
+    """Flatten a sketch summary into (key, value) pairs, joining the names of
+    nested values with colons, such as 'words:top:hello'."""
+    for field, value in summary.items():
+        key = '%s:%s' % (name, field)
+        if isinstance(value, dict):
+            yield from summary_values(key, value)
+        else:
+            yield key, value
+
+
+def scope_values(scope):
+    """Generate a (nick, key, value) triple for every total and per-user value
+    in the scope, and for every value summarizing its sketches, with an empty
+    nick for the totals."""
+    for key, value in stat_values(scope.stats):
+        yield '', key, value
+
+    for nick, user in scope.users.items():
+        for key, value in stat_values(user.stats):
+            yield nick, key, value
+
+    for key, sketch in scope.sketches.items():
+        name, nick = sketch_key(key)
+        for key, value in summary_values(name, sketch.summary()):
+            yield nick, key, value
+
+
+def scope_rows(scope, *prefix):
+    """Generate a row for every value in the scope, with the given prefix of
+    scope name, channel and period, sorted by nick and key so that the rows
+    don't depend on the order the values were first counted in."""
+    for values in sorted(scope_values(scope),
+                         key=lambda values: (values[0], str(values[1]))):
+        yield prefix + values
+
+
+def network_rows(network):
+    """Generate a flat row for every value in the hierarchy of a plugin's
+    network statistics."""
+    yield from scope_rows(network, 'network', '', '')
+
+    for name, channel in sorted(network.channels.items()):
+        yield from scope_rows(channel, 'channel', name, '')
+
+        for scope_name in ('days', 'weeks', 'months'):
+            scopes = getattr(channel, scope_name)
+            for date, scope in sorted(scopes.items()):
+                yield from scope_rows(scope, scope_name[:-1], name,
+                                      date.isoformat())
+
+
+def export_json(network, file_path):
+    with atomic_write(file_path) as fh:
+        json.dump(network_dict(network), fh, indent=1, sort_keys=True)
+
+
+def export_csv(network, file_path):
+    with atomic_write(file_path, newline='') as fh:
+        writer = csv.writer(fh)
+        writer.writerow(('scope', 'channel', 'period', 'nick', 'key',
+                         'value'))
+        writer.writerows(network_rows(network))
+
+
+def export_stats(plugin_stats, output_path, export_format):
+    """Write the statistics gathered by each plugin to a structured file in
+    the output path, named after the plugin, using the given format."""
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError('Unknown export format "%s"' % export_format)
+
+    exporter = export_json if export_format == 'json' else export_csv
+
+    for plugin, network in plugin_stats.items():
+        file_name = '{0}.{1}'.format(plugin.name, export_format).lower()
+        file_path = path.join(output_path, file_name)
+
+        exporter(network, file_path)
+
+        log.debug('exported %s statistics to "%s"', plugin.name, file_path)
@@ -1,21 +1,123 @@
 # Copyright 2013 John Reese
 # Licensed under the MIT license
 
-try:
-    import matplotlib.pyplot as plt
-    import numpy as np
-except ImportError:
-    pass  # let's be nice and not error out in setup.py
+import hashlib
+import json
+import multiprocessing
 
-from collections import Counter
+from contextlib import ExitStack
 from os import path
 
+from .cache import normalize
 from .ent import Struct
+from .lib import atomic_write, month, week
 from .log import logger
+from .series import day_values, recent_dates, resample, rolling_mean
 
 log = logger(__name__)
 FADED = '#e8e8e8'
 
+# bump this whenever changes to rendering would change existing images
+RENDER_VERSION = 1
+
+
+def pyplot():
+    """Import matplotlib's pyplot module on first use, so that nothing pays
+    the cost of importing matplotlib until graphs are actually rendered."""
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def _init_renderer():
+    """Prepare a worker process to render graphs without a display."""
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def _render_worker(task):
+    """Render a single prepared graph within a worker process."""
+    graph, output_path = task
+    graph.render(output_path)
+    return graph.output_name
+
+
+def render_graphs(graphs, output_path, jobs=None, force=False):
+    """Render a list of prepared graphs to the given output path, using a
+    pool of worker processes when configured.  Graphs whose data and options
+    haven't changed since they were last rendered are skipped, unless forced.
+    """
+    manifest = RenderManifest(output_path)
+    previous = {} if force else manifest.load()
+
+    digests = {graph.output_name: graph.digest() for graph in graphs}
+    stale = [graph for graph in graphs
+             if previous.get(graph.output_name) != digests[graph.output_name]
+             or not path.isfile(path.join(output_path, graph.output_name))]
+
+    log.info('rendering %d of %d graphs', len(stale), len(graphs))
+    render_all(stale, output_path, jobs)
+
+    manifest.save(digests)
+
+
+def render_all(graphs, output_path, jobs=None):
+    """Render every graph in the list, using a pool of worker processes when
+    configured."""
+    jobs = min(jobs or multiprocessing.cpu_count(), len(graphs))
+
+    if jobs <= 1:
+        for graph in graphs:
+            graph.render(output_path)
+        return
+
+    log.debug('rendering %d graphs with %d processes', len(graphs), jobs)
+    pool = multiprocessing.Pool(jobs, _init_renderer)
+
+    try:
+        tasks = [(graph, output_path) for graph in graphs]
+        for output_name in pool.imap_unordered(_render_worker, tasks):
+            log.debug('rendered %s', output_name)
+
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+class RenderManifest(Struct):
+    """Record a digest of each graph's data and options alongside the images
+    in the output path, so that unchanged graphs don't need to be rendered
+    again on later runs."""
+    def __init__(self, output_path):
+        Struct.__init__(self,
+                        path=path.join(output_path, 'ircstat.manifest'),
+                        )
+
+    def load(self):
+        """Return a mapping of image file names to the digests of the graphs
+        they were rendered from, or an empty mapping if there's no usable
+        manifest."""
+        try:
+            with open(self.path) as fh:
+                manifest = json.load(fh)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            log.warning('ignoring unreadable manifest "%s"', self.path)
+            return {}
+
+        if not isinstance(manifest, dict):
+            return {}
+
+        return manifest
+
+    def save(self, digests):
+        """Save the given mapping of image file names to graph digests."""
+        with atomic_write(self.path) as fh:
+            json.dump(digests, fh, indent=1, sort_keys=True)
+
+        log.debug('saved render manifest to "%s"', self.path)
+
 
 class Graph(Struct):
     """Generic graph interface."""
@@ -25,41 +127,62 @@ class Graph(Struct):
                         transform=transform, **kwargs)
 
     def prep(self, plugin, config, network):
+        """Gather and transform the data to be plotted, along with anything
+        else needed to render the graph, and then drop references to the
+        plugin, configuration and network, so that the prepared graph is small
+        and can be handed to another process for rendering."""
         self.plugin = plugin
         self.config = config
         self.network = network
 
+        self.output_name = self.filename()
+        self.xkcd_mode = config.xkcd_mode
+        self.dataset = self.transformed_data(self.data())
+
+        self.plugin = self.config = self.network = self.transform = None
+
     def filename(self):
         return '{0}_{1}.{2}'.format(self.plugin.name,
                                     self.title.replace(' ', '_'),
                                     self.config.image_format).lower()
 
+    def digest(self):
+        """Return a hash of everything that affects the rendered image of a
+        prepared graph, including its type, options and dataset."""
+        cls = type(self)
+        state = [RENDER_VERSION, cls.__module__, cls.__qualname__,
+                 normalize(self.__dict__)]
+
+        return hashlib.sha1(repr(state).encode('utf-8')).hexdigest()
+
     def render(self, output_path):
-        """Basic framework for rendering a graph to file.  Sets up a figure,
-        chains to Graph.plot() for plotting data, and then save the result to
-        the given filename as a PNG image."""
-        if self.config.xkcd_mode:
-            plt.xkcd()
+        """Basic framework for rendering a prepared graph to file.  Sets up a
+        figure, chains to Graph.plot() for plotting data, saves the result to
+        the given output path, and then closes the figure."""
+        plt = pyplot()
+
+        with ExitStack() as stack:
+            if self.xkcd_mode:
+                stack.enter_context(plt.xkcd())
 
-        plt.figure()
-        plt.title(self.title)
+            figure = plt.figure()
 
-        dataset = self.data()
-        dataset = self.transformed_data(dataset)
-        self.plot(dataset)
+            try:
+                plt.title(self.title)
+                self.plot(self.dataset)
 
-        if self.legend:
-            plt.legend(loc='best', fontsize='x-small',
-                       fancybox=True)
+                if self.legend:
+                    plt.legend(loc='best', fontsize='x-small',
+                               fancybox=True)
 
-        plt.savefig(path.join(output_path, self.filename()),
-                    dpi=200, transparent=False)
+                figure.savefig(path.join(output_path, self.output_name),
+                               dpi=200, transparent=False)
+            finally:
+                plt.close(figure)
 
     def transformed_data(self, dataset):
         """Subclasses may choose to override this in order to allow for
         more complex options for data transforms."""
-        dataset = self.data()
-
         if self.transform is None:
             return dataset
 
@@ -88,27 +211,89 @@ class Graph(Struct):
 
 class TimeSeries(Struct):
     """Representation of time-based data to be plotted. Data should be in the
-    format of sortable x,y pairs/tuples, eg. [(1,1), (2,4), (3,8), ...] """
+    format of sortable x,y pairs/tuples, eg. [(1,1), (2,4), (3,8), ...], or
+    given as separate lists of x and y values.  A color of None will use the
+    next color from matplotlib's color cycle."""
+
+    def __init__(self, label, pairs=None, color='k', linestyle='-',
+                 x=(), y=()):
+        if pairs:
+            x, y = zip(*pairs)
 
-    def __init__(self, label, pairs, color='k', linestyle='-'):
-        Struct.__init__(**locals())
+        Struct.__init__(self, label=label, x=list(x), y=list(y),
+                        color=color, linestyle=linestyle)
 
 
 class KeysOverTime(Graph):
-    """Time-series graph that will plot multiple TimeSeries objects."""
+    """Time-series graph that will plot multiple TimeSeries objects.  Daily
+    values may be summed into weeks or months, given by scope, and rolling
+    means over a number of periods may be plotted along with, or instead of,
+    the raw values."""
+
+    # functions mapping each date to its period, for each scope
+    buckets = {'days': None, 'weeks': week, 'months': month}
+
+    def __init__(self, scope='days', rolling=(), raw=True, **kwargs):
+        if scope not in self.buckets:
+            raise ValueError('Unknown time scope "%s"' % scope)
+
+        Graph.__init__(self, scope=scope, rolling=tuple(rolling), raw=raw,
+                       **kwargs)
+
+    def dates(self):
+        """Return the list of days to be graphed, ending with the last day
+        logged in the network."""
+        return recent_dates(self.network, self.config.graph_days)
+
+    def timeseries(self, label, dates, values):
+        """Return a list of TimeSeries objects for an array of daily values,
+        summed into the graph's scope, along with any rolling means."""
+        bucket = self.buckets[self.scope]
+        if bucket is not None:
+            dates, values = resample(dates, values, bucket)
+
+        return self.period_timeseries(label, dates, values)
+
+    def periods(self, dates):
+        """Return the list of periods within the graph's scope that cover the
+        given list of days."""
+        bucket = self.buckets[self.scope]
+        if bucket is None:
+            return list(dates)
+
+        return sorted(set(bucket(date) for date in dates))
+
+    def period_timeseries(self, label, periods, values):
+        """Return a list of TimeSeries objects for an array of values already
+        given for each period, along with any rolling means."""
+        result = []
+        if self.raw:
+            result.append(TimeSeries(label, x=periods, y=values.tolist(),
+                                     color=None))
+
+        unit = self.scope[:-1]
+        for window in self.rolling:
+            means = rolling_mean(values, window)
+            result.append(TimeSeries('%s (%d %s average)' % (label, window,
+                                                             unit),
+                                     x=periods, y=means.tolist(),
+                                     color=None, linestyle='--'))
+
+        return result
 
     def plot(self, dataset):
         """Plots a set of data points with the given properties."""
         assert all(isinstance(d, TimeSeries) for d in dataset)
+        plt = pyplot()
 
         for timeseries in dataset:
-            x, y = zip(*timeseries.pairs)
-
-            plt.plot(x, y,
+            plt.plot(timeseries.x, timeseries.y,
                      label=timeseries.label,
                      color=timeseries.color,
                      linestyle=timeseries.linestyle)
 
+        plt.gcf().autofmt_xdate()
+
 
 class ValueComparison(Graph):
     """Graph a set of keys/values, as either a bar or pie chart."""
@@ -119,9 +304,15 @@ class ValueComparison(Graph):
     def plot(self, dataset):
         """Plots a bar or pie chart based on key/value data, where keys are
         the labels, and the values are the relative size/amount."""
+        import numpy as np
+        plt = pyplot()
+
         if isinstance(dataset, dict):
             dataset = dataset.items()
 
+        if not dataset:
+            return
+
         if self.style == 'bar':
             ind = np.arange(len(dataset))
             width = 0.8
@@ -147,16 +338,72 @@ class ValueComparison(Graph):
         raise NotImplementedError()
 
 
-class NetworkKeyOverTime(TimeSeries):
-    """Graph a single key over time for an entire network."""
+class NetworkKeyOverTime(KeysOverTime):
+    """Graph a set of keys over time for an entire network, summed across
+    every channel, where keys maps each key to its label."""
+
+    def __init__(self, keys=None, **kwargs):
+        KeysOverTime.__init__(self, keys=keys, **kwargs)
+
+    def data(self):
+        dates = self.dates()
+        keys = list(self.keys)
+
+        values = day_values({}, keys, dates)
+        for channel in self.network.channels.values():
+            values += day_values(channel.days, keys, dates)
+
+        result = []
+        for column, key in enumerate(keys):
+            result.extend(self.timeseries(self.keys[key], dates,
+                                          values[:, column]))
+        return result
+
+
+class ChannelKeyOverTime(KeysOverTime):
+    """Graph a single key over time for each channel."""
+
+    def __init__(self, key=None, **kwargs):
+        KeysOverTime.__init__(self, key=key, **kwargs)
+
+    def data(self):
+        dates = self.dates()
+
+        result = []
+        for name, channel in sorted(self.network.channels.items()):
+            values = day_values(channel.days, [self.key], dates)
+            result.extend(self.timeseries(name, dates, values[:, 0]))
+        return result
+
+
+class ChannelDistinctOverTime(KeysOverTime):
+    """Graph the estimated number of distinct values for a single key over
+    time for each channel, read from the sketches for each day, week or month
+    rather than summed from daily values.  Each label includes the relative
+    standard error of the estimates."""
+
+    def __init__(self, key=None, **kwargs):
+        KeysOverTime.__init__(self, key=key, **kwargs)
 
-    pass
+    def data(self):
+        import numpy as np
+        periods = self.periods(self.dates())
 
+        result = []
+        for name, channel in sorted(self.network.channels.items()):
+            scopes = getattr(channel, self.scope)
+            sketches = [scopes[period].sketches.get(self.key)
+                        if period in scopes else None for period in periods]
 
-class ChannelKeyOverTime(TimeSeries):
-    """Graph a single key over time for a given channel."""
+            found = [sketch for sketch in sketches if sketch is not None]
+            if not found:
+                continue
 
-    pass
+            values = np.array([0 if sketch is None else sketch.count()
+                               for sketch in sketches], dtype=float)
+            label = '%s (+/- %.1f%%)' % (name, found[0].error * 100)
+            result.extend(self.period_timeseries(label, periods, values))
+        return result
 
 
 class NetworkKeyComparison(ValueComparison):
@@ -176,12 +423,49 @@ class NetworkUserComparison(ValueComparison):
         ValueComparison.__init__(self, key=key, **kwargs)
 
     def data(self):
-        data = Counter({nick: self.network.users[nick].stats[self.key]
-                        for nick in self.network.users})
-        return data.most_common(self.config.graph_users)
+        rankings = self.network.rankings(self.config.graph_users)
+        return rankings.get(self.key, [])
 
 
 class ChannelUserComparison(ValueComparison):
-    """Graph a comparison of user values at the channel level."""
+    """Graph a comparison of user values at the channel level, for the
+    given channel."""
+
+    def __init__(self, channel=None, key=None, **kwargs):
+        ValueComparison.__init__(self, channel=channel, key=key, **kwargs)
+
+    def data(self):
+        channel = self.network.channels.get(self.channel)
+        if channel is None:
+            return []
+
+        rankings = channel.rankings(self.config.graph_users)
+        return rankings.get(self.key, [])
+
+
+class ChannelDistinctComparison(ValueComparison):
+    """Graph a comparison of the estimated number of distinct values for a
+    single key across every channel, over the whole logged period."""
+
+    def __init__(self, key=None, **kwargs):
+        ValueComparison.__init__(self, key=key, **kwargs)
+
+    def data(self):
+        return {name: channel.distinct(self.key)
+                for name, channel in self.network.channels.items()
+                if self.key in channel.sketches}
+
+
+class NetworkTopValues(ValueComparison):
+    """Graph the most frequent values counted by a single sketch at the
+    network level, such as the most used words."""
+
+    def __init__(self, key=None, count=10, **kwargs):
+        ValueComparison.__init__(self, key=key, count=count, **kwargs)
+
+    def data(self):
+        sketch = self.network.sketches.get(self.key)
+        if sketch is None:
+            return []
 
-    pass
+        return sketch.most_common(self.count)
@@ -3,11 +3,10 @@
 
 import calendar
 import datetime
+import os
 import re
 
-from functools import lru_cache
-
-from .ent import Message
+from contextlib import contextmanager
 
 config = None
 
@@ -15,8 +14,9 @@ config = None
 def push_config(new_config):
     """Update the configuration being used by all the library functions.
     This should not be used by anything but core."""
-    global config
+    global config, _resolver
     config = new_config
+    _resolver = None
 
 
 def today():
@@ -48,42 +48,259 @@ def days_in_month(date):
     return numdays
 
 
+@contextmanager
+def atomic_write(file_path, mode='w', **kwargs):
+    """Open a temporary file next to the given path for writing, and replace
+    the file at that path with it once the with block finishes, so that other
+    processes never see a partly written file.  The temporary file is removed
+    if anything fails along the way."""
+    temp_path = '%s.%d.tmp' % (file_path, os.getpid())
+
+    try:
+        with open(temp_path, mode, **kwargs) as fh:
+            yield fh
+        os.replace(temp_path, file_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
 def is_bot(nick):
     """Determine if a nick a bot based on a configurable list of bots."""
-    if type(nick) == Message:
+    if not isinstance(nick, str):
         nick = nick.nick
     return nick in config.bots
 
 
-@lru_cache()
-def canonical(nick):
-    """Determine the canonical representation for nick based on a configurable
-    set of aliases, using regex matching, with cached results."""
-    global _aliases
-    nick = nick.lower()
+class Features(object):
+    """Features derived from a single message's content, each computed the
+    first time it's needed, so that every plugin can share them."""
+    __slots__ = ('message', '_lower', '_tokens', '_words', '_bot')
+
+    def __init__(self, message):
+        self.message = message
+        self._lower = self._tokens = self._words = self._bot = None
+
+    @property
+    def lower(self):
+        """The lowercased content, or an empty string without content."""
+        if self._lower is None:
+            self._lower = (self.message.content or '').lower()
+        return self._lower
+
+    @property
+    def tokens(self):
+        """The list of word tokens within the lowercased content."""
+        if self._tokens is None:
+            self._tokens = token_regex.findall(self.lower)
+        return self._tokens
+
+    @property
+    def words(self):
+        """The list of whitespace separated words within the content."""
+        if self._words is None:
+            self._words = (self.message.content or '').split()
+        return self._words
+
+    @property
+    def word_count(self):
+        """The number of whitespace separated words within the content."""
+        return len(self.words)
+
+    @property
+    def bot(self):
+        """Whether the message was sent by a bot."""
+        if self._bot is None:
+            self._bot = is_bot(self.message)
+        return self._bot
+
+
+def features(message):
+    """Return the shared Features object for the given message.  Features are
+    remembered until reset_features() is called, which happens whenever
+    plugins move on to a new conversation."""
+    entry = _features.get(id(message))
+
+    # the entry keeps its message alive, so a matching id means a match
+    if entry is None:
+        entry = _features[id(message)] = Features(message)
+
+    return entry
+
+
+def reset_features():
+    """Forget the features for every message seen so far."""
+    _features.clear()
+
+
+class NickPatterns(object):
+    """Match nicks against an ordered list of regexes, each forced to match
+    the entire nick, finding the first regex in the list that matches.
+    Regexes without any special characters are looked up in a hash table,
+    and the rest are grouped by their leading literal character and combined
+    into a single regex per group where possible, so the cost of matching
+    doesn't grow with the number of regexes."""
+
+    special_chars = set('.^$*+?{}[]\\|()')
+
+    # regexes with group references or flags can't be safely combined
+    unsafe_regex = re.compile(r'\\[1-9]|\(\?(P|\(|[aiLmsux])')
+
+    def __init__(self, patterns):
+        self.exact = {}
+        self.each = []
+
+        leading = {}
+        for index, pattern in enumerate(patterns):
+            if not self.special_chars.intersection(pattern):
+                self.exact.setdefault(pattern, index)
+            elif self.unsafe_regex.search(pattern):
+                self.each.append((index, re.compile(pattern + '$')))
+            else:
+                char = self.leading_char(pattern)
+                leading.setdefault(char, []).append((index, pattern))
+
+        # regexes without a leading literal may match nicks in any group
+        anywhere = leading.pop(None, [])
+        self.anywhere = self.combine(anywhere)
+        self.leading = {char: self.combine(sorted(group + anywhere))
+                        for char, group in leading.items()}
 
-    if _aliases is None:
-        _aliases = {re.compile(k + '$'): v.lower()
-                    for k, v in config.aliases.items()}
+    @classmethod
+    def leading_char(cls, pattern):
+        """Return the literal character every match of the regex must start
+        with, or None if there's no such character."""
+        char = pattern[0]
+        if (char in cls.special_chars or '|' in pattern or
+                pattern[1:2] in ('*', '?', '{')):
+            return None
+        return char
 
-    for regex in _aliases:
-        if regex.match(nick):
-            return _aliases[regex]
+    @staticmethod
+    def combine(patterns):
+        """Combine a sorted list of (index, regex) pairs into a tuple of a
+        single compiled regex and a mapping of group names to indices."""
+        if not patterns:
+            return None
 
-    return nick
+        regex = re.compile('|'.join('(?P<_%d>%s$)' % (index, pattern)
+                                    for index, pattern in patterns))
+        return regex, {'_%d' % index: index for index, _ in patterns}
+
+    def match(self, nick):
+        """Return the index of the first regex that matches the nick, or None
+        if no regexes match."""
+        best = self.exact.get(nick)
+
+        combined = self.leading.get(nick[:1], self.anywhere)
+        if combined is not None:
+            regex, groups = combined
+            match = regex.match(nick)
+            if match and (best is None or groups[match.lastgroup] < best):
+                best = groups[match.lastgroup]
+
+        for index, regex in self.each:
+            if best is not None and index > best:
+                break
+            if regex.match(nick):
+                return index
+
+        return best
+
+
+class NickResolver(object):
+    """Resolve nicks to their canonical form based on a set of aliases, and
+    determine which nicks should be ignored, remembering every result along
+    with the number of hits and misses for each table."""
+
+    def __init__(self, aliases, ignores):
+        self.aliases = NickPatterns(list(aliases))
+        self.alias_nicks = [nick.lower() for nick in aliases.values()]
+        self.ignores = NickPatterns(list(ignores))
+        self.canonical_memo = {}
+        self.ignore_memo = {}
+        self.hits = {'canonical': 0, 'ignore': 0}
+        self.misses = {'canonical': 0, 'ignore': 0}
+        self.sizes = {'canonical': 0, 'ignore': 0}
+
+    def canonical(self, nick):
+        result = self.canonical_memo.get(nick)
+
+        if result is None:
+            self.misses['canonical'] += 1
+            result = nick.lower()
+            index = self.aliases.match(result)
+            if index is not None:
+                result = self.alias_nicks[index]
+            self.canonical_memo[nick] = result
+        else:
+            self.hits['canonical'] += 1
+
+        return result
+
+    def ignore(self, nick):
+        result = self.ignore_memo.get(nick)
+
+        if result is None:
+            self.misses['ignore'] += 1
+            result = self.ignores.match(nick) is not None
+            self.ignore_memo[nick] = result
+        else:
+            self.hits['ignore'] += 1
+
+        return result
+
+    def counts(self):
+        """Return a dictionary of (hits, misses, size) for each table."""
+        return {name: (self.hits[name], self.misses[name],
+                       len(getattr(self, name + '_memo')))
+                for name in self.hits}
+
+    def add_counts(self, counts):
+        """Add the hits and misses counted by another resolver, such as one
+        in a worker process, given as (hits, misses, size) for each table.
+        Sizes are kept as the largest size seen for each table."""
+        for name, (hits, misses, size) in counts.items():
+            self.hits[name] += hits
+            self.misses[name] += misses
+            self.sizes[name] = max(self.sizes[name], size)
+
+    def stats(self):
+        """Return a dictionary of hit and miss counts for each table, along
+        with the number of remembered results."""
+        return {name: {'hits': self.hits[name],
+                       'misses': self.misses[name],
+                       'size': max(self.sizes[name],
+                                   len(getattr(self, name + '_memo')))}
+                for name in self.hits}
+
+
+def resolver():
+    """Return the NickResolver for the current configuration."""
+    global _resolver
+
+    if _resolver is None:
+        _resolver = NickResolver(config.aliases, config.ignore)
+
+    return _resolver
+
+
+def canonical(nick):
+    """Determine the canonical representation for nick based on a configurable
+    set of aliases, using regex matching, with cached results."""
+    return resolver().canonical(nick)
 
 
-@lru_cache()
 def ignore(nick):
     """Determine if the nick should be ignored.  Assumes the nick has already
     been canonicalized before being passed here."""
-    global _ignores
-
-    if _ignores is None:
-        _ignores = [re.compile(v + '$') for v in config.ignore]
+    return resolver().ignore(nick)
 
-    return any(regex.match(nick) for regex in _ignores)
 
+_resolver = None
+_features = {}
 
-_aliases = None
-_ignores = None
+token_regex = re.compile(r'\w+')
@@ -1,18 +1,377 @@
 # Copyright 2013 John Reese
 # Licensed under the MIT license
 
+import bz2
+import gzip
+import lzma
+import mmap
+import multiprocessing
 import os
 import re
+import string
+import time as timer
 
-from collections import defaultdict, OrderedDict
-from datetime import datetime
+from collections import defaultdict, deque, OrderedDict
+from datetime import date as Date, datetime, time
+from itertools import islice
 from os import path
 
-from .ent import Struct, Conversation, Message
+from .cache import ParseCache
+from .ent import Struct, Conversation, Message, MessageColumns
 from .log import logger
-from .lib import canonical, ignore
+from .lib import (ago, canonical, days_in_month, ignore, push_config,
+                  resolver)
 
 log = logger(__name__)
+_parser = None
+
+# functions for opening compressed log files, by file extension
+compressed_openers = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
+
+# errors raised when a compressed log file is truncated or corrupt
+compressed_errors = (EOFError, OSError, lzma.LZMAError)
+
+
+def open_log(file_path, encoding):
+    """Open a log file for reading as text, decompressing it on the fly if
+    it has the extension of a supported compression format."""
+    ext = path.splitext(file_path)[1].lower()
+    opener = compressed_openers.get(ext)
+
+    if opener is None:
+        return open(file_path, encoding=encoding)
+
+    return opener(file_path, 'rt', encoding=encoding)
+
+
+def buffer_lines(data):
+    """Generate each line of a memory mapped file, split the same way
+    universal newlines would split it, at any line feed, carriage return and
+    line feed, or lone carriage return, translating each to a line feed."""
+    for line in iter(data.readline, b''):
+        if b'\r' in line:
+            line = line.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+            yield from line.splitlines(True)
+        else:
+            yield line
+
+
+def byte_regexes(message_types, encoding):
+    """Given a mapping of message types to regexes, return a mapping of
+    message types to equivalent regexes that match against raw bytes in the
+    given encoding, or None if the encoding isn't compatible with ASCII."""
+    try:
+        if (string.printable.encode(encoding) !=
+                string.printable.encode('ascii')):
+            return None
+
+        return OrderedDict(
+            (message_type, re.compile(regex.pattern.encode(encoding)))
+            for message_type, regex in message_types.items())
+    except (LookupError, UnicodeError, re.error):
+        return None
+
+
+def parse_date(value):
+    """Convert a 'YYYY-MM-DD' string into a date object, passing through
+    dates and None as they are."""
+    if value is None or isinstance(value, Date):
+        return value
+
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def date_window(config):
+    """Return a tuple of the first and last dates of log files to process,
+    with None for either end when unbounded."""
+    since = parse_date(config.log_since)
+    until = parse_date(config.log_until)
+
+    if since is None and config.log_since_graph_days:
+        since = ago(days=config.graph_days)
+
+    return since, until
+
+
+# directory names for a year, optionally with a month, or for a month alone
+# only years from 1900 to 2099 count, so that other numbered directories are
+# never mistaken for years
+year_dir_regex = re.compile(
+    r'^(?P<year>(?:19|20)\d\d)(?:[-_]?(?P<month>\d{2}))?$')
+month_dir_regex = re.compile(r'^(?P<month>\d{1,2})$')
+
+
+def dir_span(name, span=None):
+    """Return a tuple of the first and last dates that could be covered by
+    logs within a directory of the given name, such as '2014', '2014-03', or
+    '03' within a year directory, or None if the name isn't a date."""
+    match = year_dir_regex.match(name)
+    if match:
+        year, month = int(match.group('year')), match.group('month')
+        if month is None:
+            return Date(year, 1, 1), Date(year, 12, 31)
+    else:
+        match = month_dir_regex.match(name)
+        if not match or span is None or (span[0].month,
+                                         span[1].month) != (1, 12):
+            return None
+        year, month = span[0].year, match.group('month')
+
+    try:
+        first = Date(year, int(month), 1)
+    except ValueError:
+        return None
+
+    return first, Date(first.year, first.month, days_in_month(first))
+
+
+def walk_logs(dir_path, window, span=None):
+    """Walk a directory tree with os.scandir(), in the same order as
+    os.walk(), generating a tuple of (directory path, file names) for each
+    directory.  When a (since, until) window is given, subdirectories named
+    after a year or month that falls entirely outside it are skipped."""
+    try:
+        entries = list(os.scandir(dir_path))
+    except OSError as e:
+        log.warning('cannot read directory "%s": %s', dir_path, e)
+        return
+
+    filenames = []
+    subdirs = []
+    for entry in entries:
+        if entry.is_dir():
+            if not entry.is_symlink():
+                subdirs.append(entry)
+        else:
+            filenames.append(entry.name)
+
+    yield dir_path, filenames
+
+    since, until = window
+    for entry in subdirs:
+        subspan = None
+        if since or until:
+            subspan = dir_span(entry.name, span)
+
+        if subspan is not None and ((since and subspan[1] < since) or
+                                    (until and subspan[0] > until)):
+            log.debug('skipping directory "%s" outside of date window',
+                      entry.path)
+            continue
+
+        yield from walk_logs(entry.path, window, subspan)
+
+
+def log_name(filename):
+    """Return the name of a log file without any compression extension."""
+    name, ext = path.splitext(filename)
+    return name if ext.lower() in compressed_openers else filename
+
+
+def _init_worker(config):
+    """Prepare a worker process to parse log files with the given config."""
+    global _parser
+    push_config(config)
+    _parser = LogParser(config)
+
+
+def _parse_worker(task):
+    """Parse a single log file within a worker process, returning the parsed
+    messages along with the matched/unmatched line counts, the time spent
+    parsing, and the nick resolver's hit/miss counts for that file."""
+    file_path, channel, date = task
+    matched, unmatched = _parser.matched, _parser.unmatched
+    parse_time = _parser.parse_time
+    before = resolver().counts()
+
+    messages = _parser.parse_log(file_path)
+
+    counts = {name: (hits - before[name][0], misses - before[name][1], size)
+              for name, (hits, misses, size) in resolver().counts().items()}
+
+    return (channel, date, messages,
+            _parser.matched - matched, _parser.unmatched - unmatched,
+            _parser.parse_time - parse_time, counts)
+
+
+class LineClassifier(Struct):
+    """Match a log line against the regexes for every message type in a single
+    step, by combining them into one alternation in message type order.  Each
+    regex's named groups are renamed to keep them distinct, and the name of
+    the outermost group that matched identifies the message type.  Regexes
+    that can't be safely combined fall back to being tried one at a time."""
+
+    # named groups that may be captured for each message
+    fields = ('time', 'nick', 'content', 'reason', 'hostmask')
+
+    # numbered backreferences and conditional groups would refer to the
+    # wrong groups once combined, and global inline flags would apply to
+    # every other regex too
+    unsafe_regex = re.compile(r'\\[1-9]|\(\?\(|\(\?[aiLmsux]+\)')
+    group_regex = re.compile(r'\(\?P(<|=)(\w+)')
+
+    # a group that never participates in a match, for any missing fields
+    missing_group = '(?!)(?P<_missing>)'
+
+    def __init__(self, message_types):
+        Struct.__init__(self,
+                        message_types=message_types,
+                        combined=None,
+                        alternatives={},
+                        )
+
+        # byte regexes are rewritten as text, with each byte kept as is
+        patterns = [regex.pattern for regex in message_types.values()]
+        binary = all(isinstance(pattern, bytes) for pattern in patterns)
+        if binary:
+            patterns = [pattern.decode('latin1') for pattern in patterns]
+
+        if any(self.unsafe_regex.search(pattern) for pattern in patterns):
+            log.debug('message regexes cannot be combined')
+            return
+
+        alternatives = []
+        for index, pattern in enumerate(patterns):
+            prefix = '_%d_' % index
+            pattern = self.group_regex.sub(r'(?P\1%s\2' % prefix, pattern)
+            alternatives.append('(?P<_%d>%s)' % (index, pattern))
+        alternatives.append(self.missing_group)
+
+        combined = '|'.join(alternatives)
+        if binary:
+            combined = combined.encode('latin1')
+
+        try:
+            self.combined = re.compile(combined)
+        except re.error as e:
+            log.debug('message regexes cannot be combined: %s', e)
+            return
+
+        groupindex = self.combined.groupindex
+        missing = groupindex['_missing']
+
+        for index, message_type in enumerate(message_types):
+            groups = tuple(groupindex.get('_%d_%s' % (index, field), missing)
+                           for field in self.fields)
+            self.alternatives['_%d' % index] = (message_type, groups)
+
+    def classify(self, line):
+        """Return a tuple of the message type, and a tuple of the captured
+        fields from the matching regex, or (None, None) for unmatched lines."""
+        if self.combined is None:
+            return self.classify_each(line)
+
+        match = self.combined.match(line)
+        if match is None:
+            return None, None
+
+        message_type, groups = self.alternatives[match.lastgroup]
+
+        return message_type, match.group(*groups)
+
+    def classify_each(self, line):
+        """Classify a line by trying each message type's regex in turn."""
+        for message_type, message_regex in self.message_types.items():
+            match = message_regex.match(line)
+            if match:
+                content = match.groupdict()
+                return message_type, tuple(content.get(field)
+                                           for field in self.fields)
+
+        return None, None
+
+
+class TimeDecoder(Struct):
+    """Convert timestamps from log lines into time objects, or into seconds
+    since midnight.  Decoded timestamps are remembered in a bounded table, as
+    a day only has so many distinct timestamps, and formats made up of only
+    hours, minutes, seconds and fixed separators are decoded by slicing out
+    the digits rather than going through datetime.strptime()."""
+
+    # formatting directives that can be sliced out as two digits, along with
+    # the largest value accepted by datetime.strptime()
+    fixed_fields = {'H': 23, 'M': 59, 'S': 59}
+
+    # number of decoded timestamps to remember before starting over
+    memo_size = 100000
+
+    def __init__(self, time_format, seconds=False):
+        Struct.__init__(self,
+                        time_format=time_format,
+                        seconds=seconds,
+                        layout=self.fixed_layout(time_format),
+                        memo={},
+                        )
+
+    @classmethod
+    def fixed_layout(cls, time_format):
+        """Return a tuple of (width, literals, fields) describing a fixed
+        width format, or None if the format can't be sliced."""
+        literals = []
+        fields = {}
+        offset = 0
+        chars = iter(time_format)
+
+        for char in chars:
+            if char == '%':
+                directive = next(chars, '')
+                if directive not in cls.fixed_fields or directive in fields:
+                    return None
+                fields[directive] = offset
+                offset += 2
+            elif char.isspace():
+                return None
+            else:
+                literals.append((offset, char))
+                offset += 1
+
+        return offset, tuple(literals), fields
+
+    def decode(self, value):
+        """Return the time of day for the given timestamp string."""
+        result = self.memo.get(value)
+
+        if result is None:
+            result = self.decode_fixed(value)
+            if result is None:
+                result = datetime.strptime(value, self.time_format).time()
+            if self.seconds:
+                result = (result.hour * 3600 + result.minute * 60 +
+                          result.second)
+
+            if len(self.memo) >= self.memo_size:
+                self.memo.clear()
+            self.memo[value] = result
+
+        return result
+
+    def decode_fixed(self, value):
+        """Slice the digits out of a timestamp with a fixed width format, and
+        return a time object, or None if the timestamp doesn't fit."""
+        if self.layout is None:
+            return None
+
+        width, literals, fields = self.layout
+        if len(value) != width:
+            return None
+        if any(value[offset] != char for offset, char in literals):
+            return None
+
+        values = {}
+        for directive, offset in fields.items():
+            digits = value[offset:offset + 2]
+            if not ('0' <= digits[0] <= '9' and '0' <= digits[1] <= '9'):
+                return None
+            values[directive] = int(digits)
+            if values[directive] > self.fixed_fields[directive]:
+                return None
+
+        return time(values.get('H', 0), values.get('M', 0),
+                    values.get('S', 0))
 
 
 class LogParser(Struct):
@@ -26,58 +385,186 @@ class LogParser(Struct):
             (Message.PART, re.compile(config.log_part_regex)),
             (Message.QUIT, re.compile(config.log_quit_regex)),
         ])
+        cache = ParseCache(config) if config.parse_cache else None
+
+        byte_classifier = None
+        if config.log_mmap:
+            byte_types = byte_regexes(message_types, config.log_encoding)
+            if byte_types is None:
+                log.warning('log encoding "%s" cannot be parsed as bytes, '
+                            'parsing log files as text', config.log_encoding)
+            else:
+                byte_classifier = LineClassifier(byte_types)
+
         Struct.__init__(self,
                         config=config,
                         message_types=message_types,
+                        classifier=LineClassifier(message_types),
+                        byte_classifier=byte_classifier,
+                        time_decoder=TimeDecoder(config.log_timestamp_format,
+                                                 seconds=True),
+                        cache=cache,
                         matched=0,
                         unmatched=0,
+                        parse_time=0.0,
                         )
 
     def parse_log(self, file_path):
-        """Given a single path to a log file, parse the file and return a list
-        of messages from the conversation."""
+        """Given a single path to a log file, return a list of messages from
+        the conversation, using the parse cache when possible.  The time spent
+        is added to parse_time."""
+        start = timer.perf_counter()
+        try:
+            return self.load_log(file_path)
+        finally:
+            self.parse_time += timer.perf_counter() - start
+
+    def load_log(self, file_path):
+        """Return the messages from a single log file, from the parse cache
+        when possible, or by reading the file and storing the result."""
+
+        if self.cache is not None:
+            cached = self.cache.load(file_path)
+            if cached is not None:
+                messages, matched, unmatched = cached
+                self.matched += matched
+                self.unmatched += unmatched
+                return messages
+
+        matched, unmatched = self.matched, self.unmatched
+        messages = self.read_log(file_path)
+
+        if self.cache is not None:
+            self.cache.store(file_path, messages,
+                             self.matched - matched,
+                             self.unmatched - unmatched)
+
+        return messages
+
+    def read_log(self, file_path):
+        """Given a single path to a log file, parse the file and return the
+        messages from the conversation as a MessageColumns object."""
 
-        messages = []
+        messages = MessageColumns(self.config.log_timestamp_seconds)
 
         log.debug('parsing log file "%s"', file_path)
 
-        with open(file_path, encoding=self.config.log_encoding) as logfile:
-            lineno = 1
-            for line in logfile:
-                for message_type, message_regex in self.message_types.items():
-                    match = message_regex.match(line)
-                    if match:
-                        content = match.groupdict()
-
-                        content['nick'] = canonical(content['nick'])
-                        if ignore(content['nick']):
-                            break
-
-                        content['time'] = datetime.strptime(
-                            content['time'],
-                            self.config.log_timestamp_format,
-                            ).time()
-                        messages.append(Message(message_type,
-                                                **content))
-                        self.matched += 1
-                        break
-
-                if not match:
-                    log.debug('line %d did not match anything', lineno)
-                    self.unmatched += 1
-
-                lineno += 1
+        compressed = log_name(file_path) != file_path
+
+        if self.byte_classifier is not None and not compressed:
+            self.read_mapped(file_path, messages)
+            return messages
+
+        with open_log(file_path, self.config.log_encoding) as logfile:
+            try:
+                self.read_lines(logfile, messages)
+            except compressed_errors as e:
+                # only truncated or corrupt compressed files are expected;
+                # any other error reading a plain log file is a real failure
+                if not compressed:
+                    raise
+                log.warning('failed to read all of log file "%s": %s',
+                            file_path, e)
 
         return messages
 
-    def parse_logs(self, input_paths):
-        """Given a list of directories, search those directories for log files
-        matching the configured filename regex, and then send each file for
-        individual parsing."""
+    def read_lines(self, logfile, messages):
+        """Parse each line from an open log file, adding the messages to the
+        given MessageColumns object."""
+        append = messages.append
+        classify = self.classifier.classify
+        decode_time = self.time_decoder.decode
 
-        conversations = defaultdict(lambda: defaultdict(bool))
+        for lineno, line in enumerate(logfile, 1):
+            message_type, fields = classify(line)
+
+            if message_type is None:
+                log.debug('line %d did not match anything', lineno)
+                self.unmatched += 1
+                continue
+
+            time, nick, content, reason, hostmask = fields
+
+            nick = canonical(nick)
+            if ignore(nick):
+                continue
+
+            time = decode_time(time)
+            append(message_type, time, nick, content, reason, hostmask)
+            self.matched += 1
+
+    def read_mapped(self, file_path, messages):
+        """Memory map an uncompressed log file and match each line as raw
+        bytes, adding the messages to the given MessageColumns object.  Only
+        the captured fields of messages that are kept get decoded to text,
+        and each distinct nick and timestamp is only decoded once."""
+        with open(file_path, 'rb') as fh:
+            if os.fstat(fh.fileno()).st_size == 0:
+                return
+
+            with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                self.read_buffer(data, messages)
+
+    def read_buffer(self, data, messages):
+        """Parse each line of a memory mapped log file as raw bytes, adding
+        the messages to the given MessageColumns object."""
+        append = messages.append
+        classify = self.byte_classifier.classify
+        decode_time = self.time_decoder.decode
+        encoding = self.config.log_encoding
+
+        # canonical nicks, or None for ignored nicks, by their raw bytes
+        nicks = {}
+        times = {}
+
+        for lineno, line in enumerate(buffer_lines(data), 1):
+            message_type, fields = classify(line)
+
+            if message_type is None:
+                log.debug('line %d did not match anything', lineno)
+                self.unmatched += 1
+                continue
+
+            time, nick, content, reason, hostmask = fields
+
+            if nick in nicks:
+                canonical_nick = nicks[nick]
+            else:
+                canonical_nick = canonical(nick.decode(encoding))
+                if ignore(canonical_nick):
+                    canonical_nick = None
+                nicks[nick] = canonical_nick
+
+            if canonical_nick is None:
+                continue
+
+            if time in times:
+                seconds = times[time]
+            else:
+                seconds = times[time] = decode_time(time.decode(encoding))
+
+            if content is not None:
+                content = content.decode(encoding)
+            if reason is not None:
+                reason = reason.decode(encoding)
+            if hostmask is not None:
+                hostmask = hostmask.decode(encoding)
+
+            append(message_type, seconds, canonical_nick, content, reason,
+                   hostmask)
+            self.matched += 1
+
+    def find_logs(self, input_paths):
+        """Given a list of directories, search those directories for log files
+        matching the configured filename regex, and generate a tuple of
+        (file path, channel, date) for each matching file within the
+        configured date window."""
 
         filename_regex = re.compile(self.config.filename_regex)
+        window = date_window(self.config)
+
+        if window != (None, None):
+            log.debug('only finding log files from %s to %s', *window)
 
         for input_path in input_paths:
             input_path = path.realpath(input_path)
@@ -89,29 +576,117 @@ class LogParser(Struct):
 
             log.debug('walking input directory "%s"', input_path)
 
-            for dir_path, subdirs, filenames in os.walk(input_path):
-                log.debug((dir_path, filenames, subdirs))
+            for dir_path, filenames in walk_logs(input_path, window):
+                log.debug((dir_path, filenames))
 
                 for filename in filenames:
-                    match = filename_regex.search(filename)
+                    found = self.match_log(filename_regex, filename, window)
+
+                    if found is not None:
+                        channel, date = found
+                        yield path.join(dir_path, filename), channel, date
+
+    def match_log(self, filename_regex, filename, window):
+        """Return a tuple of (channel, date) for a log file name matching the
+        filename regex within the date window, or None otherwise."""
+        match = filename_regex.search(log_name(filename))
+
+        if not match:
+            log.debug('skipping file "%s"', filename)
+            return None
+
+        channel = match.group('channel')
+        datestr = match.group('date')
+        date = datetime.strptime(datestr,
+                                 self.config.filename_date_format,
+                                 ).date()
+
+        since, until = window
+        if (since and date < since) or (until and date > until):
+            log.debug('skipping file "%s" outside of date window', filename)
+            return None
+
+        return channel, date
+
+    def parse_serial(self, logs):
+        """Parse each of the given (file path, channel, date) tuples in the
+        current process, generating a tuple of (channel, date, messages)."""
+        for file_path, channel, date in logs:
+            yield channel, date, self.parse_log(file_path)
 
-                    if not match:
-                        log.debug('skipping file "%s"', filename)
-                        continue
+    def parse_parallel(self, logs, jobs):
+        """Parse each of the given (file path, channel, date) tuples using a
+        pool of worker processes, generating a tuple of (channel, date,
+        messages) in the same order as the given logs.  Only a small window of
+        files is in flight at any time, so parsed results never pile up
+        faster than they are consumed."""
+        logs = iter(logs)
+        pool = multiprocessing.Pool(jobs, _init_worker, (self.config,))
 
-                    file_path = path.join(dir_path, filename)
-                    channel = match.group('channel')
-                    datestr = match.group('date')
-                    date = datetime.strptime(datestr,
-                                             self.config.filename_date_format,
-                                             ).date()
+        try:
+            pending = deque(pool.apply_async(_parse_worker, (task,))
+                            for task in islice(logs, jobs * 2))
 
-                    messages = self.parse_log(file_path)
-                    conversation = Conversation(channel, date, messages)
-                    conversations[channel][date] = conversation
+            while pending:
+                result = pending.popleft().get()
 
-        log.debug('parsing all input paths complete')
+                for task in islice(logs, 1):
+                    pending.append(pool.apply_async(_parse_worker, (task,)))
+
+                (channel, date, messages, matched, unmatched, parse_time,
+                 counts) = result
+                self.matched += matched
+                self.unmatched += unmatched
+                self.parse_time += parse_time
+                resolver().add_counts(counts)
+                yield channel, date, messages
+
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def parse_files(self, logs):
+        """Given a list of (file path, channel, date) tuples, generate a
+        Conversation object for each file as soon as it has been parsed,
+        using multiple processes when configured."""
+
+        logs = list(logs)
+        jobs = self.config.parse_jobs or multiprocessing.cpu_count()
+
+        if jobs > 1 and len(logs) > 1:
+            log.debug('parsing %d log files with %d processes',
+                      len(logs), jobs)
+            results = self.parse_parallel(logs, min(jobs, len(logs)))
+        else:
+            results = self.parse_serial(logs)
+
+        for channel, date, messages in results:
+            yield Conversation(channel, date, messages)
+
+        if self.cache is not None:
+            self.cache.prune()
+
+        log.debug('parsing all log files complete')
         log.debug('%d log lines matched regexes', self.matched)
         log.debug('%d log lines unmatched', self.unmatched)
 
+    def parse_logs(self, input_paths):
+        """Given a list of directories, search those directories for log files
+        matching the configured filename regex, and then send each file for
+        individual parsing, returning every conversation keyed by channel and
+        date."""
+
+        return self.parse_all(self.find_logs(input_paths))
+
+    def parse_all(self, logs):
+        """Given a list of (file path, channel, date) tuples, parse every file,
+        returning every conversation keyed by channel and date."""
+
+        conversations = defaultdict(lambda: defaultdict(bool))
+
+        for conversation in self.parse_files(logs):
+            channel, date = conversation.channel, conversation.date
+            conversations[channel][date] = conversation
+
         return conversations
@@ -7,7 +7,7 @@ import os
 from functools import lru_cache
 from os import path
 
-from .base import Plugin
+from .base import Plugin, Dispatcher  # noqa
 
 
 @lru_cache()
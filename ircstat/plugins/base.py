@@ -1,34 +1,90 @@
 # Copyright 2013 John Reese
 # Licensed under the MIT license
 
-from ..ent import Struct, NetworkStat
+import time
+
+from collections import defaultdict
+
+from ..ent import Struct, ArrayNetworkStat, Conversation, NetworkStat
 from ..log import logger
-from ..lib import month, week
+from ..lib import month, reset_features
 
 log = logger(__name__)
 
 
 class Plugin(Struct):
     """A pluggable class for generating and displaying message statistics."""
+
+    # classes used to store statistics, by the configured backend name
+    stats_backends = {
+        'dict': NetworkStat,
+        'array': ArrayNetworkStat,
+    }
+
+    # plugins that count sketches for whole months, rather than for single
+    # days, can't remove a single day's statistics; they set this to a
+    # function mapping each date to its period, such as lib.month, so that
+    # removing any day makes just those plugins process every other day in
+    # that period again
+    removal_period = None
+
     def __init__(self, config):
         Struct.__init__(self,
                         config=config,
                         **config.plugins.__dict__[self.name].__dict__)
 
+    def start(self, network=None):
+        """Prepare a fresh NetworkStat object for processing conversations,
+        or continue with a NetworkStat from a previous run."""
+        if network is None:
+            network = self.stats_backends[self.config.stats_backend]()
+
+        self.network = network
+
+    def switch_context(self, channel, date):
+        """Select the channel and daily statistics objects that following
+        messages will be counted towards.  Only daily statistics are counted
+        directly, so the channel and network rollups are invalidated."""
+        self.channel = self.network.channels[channel]
+        self.day = self.channel.days[date]
+        self.date = date
+
+        self.channel.invalidate()
+        self.network.invalidate()
+        reset_features()
+
+    def finish(self):
+        """Finish processing conversations and return the NetworkStat."""
+        return self.network
+
+    def remove_day(self, channel, date):
+        """Remove everything counted for a single channel and date from the
+        statistics, as though that conversation had never been processed."""
+        chan = self.network.channels.get(channel)
+        if chan is None or date not in chan.days:
+            return
+
+        # sketches counted for the whole month can't have a single day
+        # removed, so they're dropped along with it
+        del chan.days[date]
+        chan.month_sketches.pop(month(date), None)
+        if chan.days:
+            chan.invalidate()
+        else:
+            del self.network.channels[channel]
+
+        self.network.invalidate()
+
     def process(self, conversations):
         """Process a list of conversations and return a NetworkStat object."""
-        self.network = NetworkStat()
+        self.start()
 
         for channel in conversations:
-            self.channel = self.network.channels[channel]
-
             for date, conversation in conversations[channel].items():
-                self.day = self.channel.days[date]
-                self.week = self.channel.weeks[week(date)]
-                self.month = self.channel.months[month(date)]
+                self.switch_context(channel, date)
                 self.process_conversation(conversation)
 
-        return self.network
+        return self.finish()
 
     def process_conversation(self, conversation):
         """Process a single conversation, with the given network, channel, and
@@ -44,28 +100,138 @@ class Plugin(Struct):
 
     def inc_user_stats(self, nick, **kwargs):
         """Increment user stat counters for the given key/value pairs."""
-        for key, value in kwargs.items():
-            self.network.users[nick].stats[key] += value
-            self.channel.users[nick].stats[key] += value
-            self.day.users[nick].stats[key] += value
-            self.week.users[nick].stats[key] += value
-            self.month.users[nick].stats[key] += value
+        self.day.inc_user(nick, self.network.prepare(kwargs))
 
     def inc_network_stats(self, **kwargs):
         """Increment aggregate stat counters for the given key/value pairs."""
-        for key, value in kwargs.items():
-            self.network.stats[key] += value
-            self.channel.stats[key] += value
-            self.day.stats[key] += value
-            self.week.stats[key] += value
-            self.month.stats[key] += value
+        self.day.inc(self.network.prepare(kwargs))
 
     def inc_shared_stats(self, nick, **kwargs):
         """Increment shared user/aggregate stat counters."""
-        self.inc_user_stats(nick, **kwargs)
-        self.inc_network_stats(**kwargs)
+        values = self.network.prepare(kwargs)
+        self.day.inc_user(nick, values)
+        self.day.inc(values)
 
     def generate_graphs(self):
         """Return a list of Graph objects."""
 
         return []
+
+
+class Dispatcher(Struct):
+    """Feed conversations to a set of plugins in a single pass, setting up the
+    statistics context once per conversation and handing each message to
+    every plugin in turn."""
+    def __init__(self, plugins, timings=None):
+        Struct.__init__(self,
+                        plugins=list(plugins),
+                        timings=timings,
+                        )
+
+    def start(self, networks=None):
+        """Prepare every plugin, optionally continuing from a mapping of
+        plugin names to NetworkStat objects from a previous run, and sort out
+        which plugins need to see whole conversations rather than individual
+        messages."""
+        if networks is None:
+            networks = {}
+
+        self.message_handlers = []
+        self.conversation_handlers = []
+
+        for plugin in self.plugins:
+            plugin.start(networks.get(plugin.name))
+
+            if (type(plugin).process_conversation is
+                    Plugin.process_conversation):
+                self.message_handlers.append(plugin.process_message)
+            else:
+                self.conversation_handlers.append(plugin.process_conversation)
+
+            if self.timings is not None:
+                self.timings.setdefault(plugin.name, [0.0, 0.0, 0])
+
+    def feed(self, conversation):
+        """Process a single conversation with every plugin.  Messages are
+        gathered into a list once, so that every plugin sees the same message
+        objects, and shares the features computed for them."""
+        channel, date = conversation.channel, conversation.date
+
+        for plugin in self.plugins:
+            plugin.switch_context(channel, date)
+
+        conversation = Conversation(channel, date,
+                                    list(conversation.messages))
+
+        if self.timings is not None:
+            return self.feed_timed(conversation)
+
+        for handler in self.conversation_handlers:
+            handler(conversation)
+
+        handlers = self.message_handlers
+        if handlers:
+            for message in conversation.messages:
+                for handler in handlers:
+                    handler(message)
+
+    def feed_timed(self, conversation):
+        """Process a single conversation with each plugin in turn, adding the
+        wall and cpu time spent by each plugin to its timings.  Every plugin
+        walks the same list of messages, so features are shared just as they
+        are without timings."""
+        for plugin in self.plugins:
+            wall, cpu = time.perf_counter(), time.process_time()
+
+            if plugin.process_message in self.message_handlers:
+                for message in conversation.messages:
+                    plugin.process_message(message)
+            else:
+                plugin.process_conversation(conversation)
+
+            timing = self.timings[plugin.name]
+            timing[0] += time.perf_counter() - wall
+            timing[1] += time.process_time() - cpu
+            timing[2] += 1
+
+    def removal_periods(self):
+        """Return a mapping of each function mapping dates to the period that
+        must be processed again as a whole, to the list of plugins that can't
+        remove single days from within that period."""
+        periods = defaultdict(list)
+        for plugin in self.plugins:
+            if plugin.removal_period is not None:
+                periods[plugin.removal_period].append(plugin)
+        return periods
+
+    def feed_period(self, conversation, period):
+        """Process a single conversation again with only the plugins using
+        the given removal period, after a day in the same period was removed
+        from their statistics."""
+        channel, date = conversation.channel, conversation.date
+        conversation = Conversation(channel, date,
+                                    list(conversation.messages))
+
+        for plugin in self.removal_periods()[period]:
+            plugin.switch_context(channel, date)
+            plugin.process_conversation(conversation)
+
+    def remove_day(self, channel, date):
+        """Remove a single channel and date from every plugin's statistics."""
+        for plugin in self.plugins:
+            plugin.remove_day(channel, date)
+
+    def finish(self):
+        """Return a mapping of each plugin to its resulting NetworkStat."""
+        return {plugin: plugin.finish() for plugin in self.plugins}
+
+    def process(self, conversations):
+        """Process a set of conversations with every plugin, returning a
+        mapping of each plugin to its resulting NetworkStat."""
+        self.start()
+
+        for channel in conversations:
+            for conversation in conversations[channel].values():
+                self.feed(conversation)
+
+        return self.finish()
@@ -3,11 +3,105 @@
 
 import re
 
-from ..lib import is_bot
+from ..ent import Struct
+from ..lib import features, token_regex
 from ..graphs import NetworkKeyComparison, NetworkUserComparison
 from .base import Plugin
 
 
+class PatternCounter(Struct):
+    """Count the matches for a list of regexes within some content, using a
+    single pass over the content wherever possible.  Regexes that can only
+    ever match whole words are looked up per word, with the results for each
+    distinct word remembered in a bounded table.  Any other regexes are
+    combined into one regex that is used to skip content where none of them
+    can match, before falling back to counting each regex separately."""
+
+    # regexes built only from word characters, groups and repetition can
+    # only ever match a whole word when wrapped in word boundaries
+    word_only_regex = re.compile(r'[\w()|?*+]*$')
+
+    # number of distinct words to remember before starting over
+    table_size = 100000
+
+    def __init__(self, patterns, word_regex):
+        words = []
+        others = []
+
+        for index, pattern in enumerate(patterns):
+            if self.word_only(pattern):
+                words.append((index, re.compile(pattern)))
+            else:
+                others.append((index, re.compile(word_regex % pattern)))
+
+        combined = None
+        if others:
+            combined = re.compile('|'.join('(?:%s)' % regex.pattern
+                                           for _, regex in others))
+
+        Struct.__init__(self,
+                        size=len(patterns),
+                        words=words,
+                        others=others,
+                        combined=combined,
+                        table={},
+                        )
+
+    @classmethod
+    def word_only(cls, pattern):
+        """Determine if the regex, wrapped in word boundaries, can only ever
+        match a single whole word.  Regexes that match an empty string, or
+        that have alternatives outside of any group, don't qualify."""
+        simple = pattern.replace('(?:', '(')
+        if not cls.word_only_regex.match(simple):
+            return False
+
+        depth = 0
+        for char in simple:
+            if char == '(':
+                depth += 1
+            elif char == ')':
+                depth -= 1
+            elif char == '|' and depth == 0:
+                return False
+
+        return not re.fullmatch(pattern, '')
+
+    def lookup(self, token):
+        """Return a tuple of the regex indexes that match a single word."""
+        if len(self.table) >= self.table_size:
+            self.table.clear()
+
+        matches = tuple(index for index, regex in self.words
+                        if regex.fullmatch(token))
+        self.table[token] = matches
+
+        return matches
+
+    def count(self, content, tokens=None):
+        """Return a list of the number of matches for each regex, optionally
+        given the list of word tokens already found within the content."""
+        counts = [0] * self.size
+        table = self.table
+
+        if self.words:
+            if tokens is None:
+                tokens = token_regex.findall(content)
+
+            for token in tokens:
+                matches = table.get(token)
+                if matches is None:
+                    matches = self.lookup(token)
+                for index in matches:
+                    counts[index] += 1
+
+        if self.combined is not None and self.combined.search(content):
+            for index, regex in self.others:
+                counts[index] = len(regex.findall(content))
+
+        return counts
+
+
 class Highbrow(Plugin):
     """Gathers metrics related to how intelligent the conversation (or users)
     may be, like swear words used, etc."""
@@ -40,25 +134,29 @@ class Highbrow(Plugin):
     word_regex = r'\b%s\b'
 
     def process_message(self, message):
-        if is_bot(message) or not message.content:
+        if not message.content:
+            return
+
+        feats = features(message)
+        if feats.bot:
             return
 
         nick = message.nick
-        content = message.content.lower()
 
-        if self._swears is None:
-            self._swears = {swear: re.compile(self.word_regex % regex)
-                            for swear, regex in self.swears.items()}
-            self._phrases = {phrase: re.compile(self.word_regex % regex)
-                             for phrase, regex in self.phrases.items()}
+        if self._counter is None:
+            self._keys = list(self.swears) + list(self.phrases)
+            self._counter = PatternCounter(
+                list(self.swears.values()) + list(self.phrases.values()),
+                self.word_regex)
+
+        counts = self._counter.count(feats.lower, feats.tokens)
+        split = len(self.swears)
 
-        swears = {swear: len(regex.findall(content))
-                  for swear, regex in self._swears.items()}
-        swears['total_swears'] = sum(swears.values())
+        swears = dict(zip(self._keys[:split], counts[:split]))
+        swears['total_swears'] = sum(counts[:split])
 
-        phrases = {phrase: len(regex.findall(content))
-                   for phrase, regex in self._phrases.items()}
-        phrases['total_phrases'] = sum(phrases.values())
+        phrases = dict(zip(self._keys[split:], counts[split:]))
+        phrases['total_phrases'] = sum(counts[split:])
 
         self.inc_shared_stats(nick, **swears)
         self.inc_shared_stats(nick, **phrases)
@@ -83,6 +181,6 @@ class Highbrow(Plugin):
                                   ),
         ]
 
-    # cache compiled regexes
-    _swears = None
-    _phrases = None
+    # cache the compiled pattern counter
+    _counter = None
+    _keys = None
@@ -1,9 +1,10 @@
 # Copyright 2013 John Reese
 # Licensed under the MIT license
 
-from ..lib import is_bot
+from ..lib import features
 from ..ent import Message
-from ..graphs import NetworkKeyComparison, NetworkUserComparison
+from ..graphs import (ChannelKeyOverTime, NetworkKeyComparison,
+                      NetworkKeyOverTime, NetworkUserComparison)
 from .base import Plugin
 
 
@@ -35,17 +36,26 @@ class Totals(Plugin):
                                   style='pie',
                                   key=Message.type_to_name(Message.MESSAGE)
                                   ),
+            NetworkKeyOverTime(title='Messages Per Day',
+                               keys={'message': 'messages'},
+                               rolling=(7, 30),
+                               ),
+            ChannelKeyOverTime(title='Channel Messages Per Day',
+                               key='message',
+                               rolling=(7,),
+                               raw=False,
+                               ),
         ]
 
 
 class Wordcount(Plugin):
     """Tracks the average word count of messages."""
     def process_message(self, message):
-        if is_bot(message) or not message.content:
+        if not message.content or features(message).bot:
             return
 
         nick = message.nick
-        word_count = len(message.content.split())
+        word_count = features(message).word_count
 
         self.inc_shared_stats(nick,
                               word_count_total=word_count,
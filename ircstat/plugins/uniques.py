@@ -0,0 +1,57 @@
+# Copyright 2013 John Reese
+# Licensed under the MIT license
+
+from ..ent import Message
+from ..lib import is_bot
+from ..graphs import ChannelDistinctComparison, ChannelDistinctOverTime
+from ..sketch import HyperLogLog
+from .base import Plugin
+
+
+class Uniques(Plugin):
+    """Estimates the number of distinct users active in each channel, by day,
+    week, month and overall, without keeping every nick.  Each day of each
+    channel keeps a HyperLogLog sketch of the nicks that sent messages or
+    actions, and weekly, monthly and channel sketches are merged from them
+    when read."""
+
+    # each sketch uses up to 2 ** precision bytes, and estimates have a
+    # relative standard error of 1.04 / sqrt(2 ** precision), so 10 gives
+    # about 3.3% with 1 KB, 12 about 1.6% with 4 KB, and 14 about 0.8% with
+    # 16 KB; must be between 4 and 16
+    precision = 12
+
+    # message types that count a nick as active
+    active_types = (Message.MESSAGE, Message.ACTION)
+
+    def new_sketch(self):
+        return HyperLogLog(self.precision)
+
+    def process_conversation(self, conversation):
+        nicks = set(message.nick for message in conversation.messages
+                    if message.type in self.active_types)
+        nicks = [nick for nick in nicks if not is_bot(nick)]
+
+        if nicks:
+            self.day.sketch('active_users', self.new_sketch).update(nicks)
+
+    def generate_graphs(self):
+        return [
+            ChannelDistinctOverTime(title='Unique Users Per Day',
+                                    key='active_users',
+                                    rolling=(7,),
+                                    raw=False,
+                                    ),
+            ChannelDistinctOverTime(title='Unique Users Per Week',
+                                    key='active_users',
+                                    scope='weeks',
+                                    ),
+            ChannelDistinctOverTime(title='Unique Users Per Month',
+                                    key='active_users',
+                                    scope='months',
+                                    ),
+            ChannelDistinctComparison(title='Unique Users Per Channel',
+                                      style='bar',
+                                      key='active_users',
+                                      ),
+        ]
@@ -0,0 +1,91 @@
+# Copyright 2013 John Reese
+# Licensed under the MIT license
+
+from collections import Counter, defaultdict
+
+from ..lib import features, month
+from ..graphs import NetworkTopValues
+from ..sketch import CountMinSketch
+from .base import Plugin
+
+
+class Vocabulary(Plugin):
+    """Tracks the most used words across the whole vocabulary, by channel and
+    by month, and optionally by user, without keeping a count for every word.
+    Each month of each channel keeps a Count-Min sketch of the words used,
+    along with the most frequent words, and channel and network sketches are
+    merged from them when read.  Sketches are kept for whole months rather
+    than for each day, so that memory grows with the number of channels and
+    months, and changing or removing a single day's log file means that this
+    plugin alone processes every other log file for that channel and month
+    again in incremental runs."""
+
+    removal_period = staticmethod(month)
+
+    # each channel and month keeps a sketch of up to width * depth * 4 bytes,
+    # or 16 KB by default, plus a few KB for the most frequent words, no
+    # matter how many distinct words are seen; estimates are too high by at
+    # most e / width of the total words with probability 1 - e ** -depth
+    width = 1024
+    depth = 4
+
+    # number of most frequent words tracked by each sketch
+    top_words = 50
+
+    # number of words shown in the graph of most used words
+    graph_words = 10
+
+    # also keep a sketch for each user within each month and channel
+    # note: this can use much more memory, as every active user that uses
+    # more than a few hundred distinct words in a month will need a full
+    # sketch
+    user_words = False
+
+    # words that are too common to be interesting
+    stopwords = {
+        'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'do', 'for',
+        'have', 'i', 'if', 'in', 'is', 'it', 'me', 'my', 'no', 'not', 'of',
+        'on', 'or', 's', 'so', 't', 'that', 'the', 'this', 'to', 'was', 'we',
+        'what', 'with', 'you',
+    }
+
+    def new_sketch(self):
+        return CountMinSketch(self.width, self.depth, self.top_words)
+
+    def process_conversation(self, conversation):
+        words = Counter()
+        users = defaultdict(Counter)
+        stopwords = self.stopwords
+
+        for message in conversation.messages:
+            if not message.content:
+                continue
+
+            feats = features(message)
+            if feats.bot:
+                continue
+
+            tokens = [token for token in feats.tokens
+                      if token not in stopwords and not token.isdigit()]
+            words.update(tokens)
+            if self.user_words:
+                users[message.nick].update(tokens)
+
+        if words:
+            self.month_sketch('words').update(words)
+
+        for nick, counts in users.items():
+            if counts:
+                self.month_sketch(('words', nick)).update(counts)
+
+    def month_sketch(self, key):
+        return self.channel.month_sketch(self.date, key, self.new_sketch)
+
+    def generate_graphs(self):
+        return [
+            NetworkTopValues(title='Most Used Words',
+                             style='bar',
+                             key='words',
+                             count=self.graph_words,
+                             ),
+        ]
@@ -0,0 +1,164 @@
+# Copyright 2013 John Reese
+# Licensed under the MIT license
+
+import json
+import sys
+import time
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from os import path
+
+from .ent import Struct
+from .lib import atomic_write, resolver
+from .log import logger
+
+try:
+    import resource
+except ImportError:
+    resource = None  # not available on windows
+
+log = logger(__name__)
+
+
+def peak_memory():
+    """Return a tuple of the peak resident memory, in bytes, used by this
+    process and by its finished child processes, or None where unknown."""
+    if resource is None:
+        return None, None
+
+    # linux reports kilobytes, while macos reports bytes
+    scale = 1 if sys.platform == 'darwin' else 1024
+
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+
+def child_cpu_time():
+    """Return the cpu time used by finished child processes, such as the
+    worker processes used to parse logs and render graphs."""
+    if resource is None:
+        return None
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Profiler(Struct):
+    """Record the wall and cpu time spent in each stage of a run, and in each
+    plugin, and summarize them along with parsing and memory statistics.
+    When disabled, stages cost next to nothing and nothing is recorded."""
+    def __init__(self, enabled=False):
+        Struct.__init__(self,
+                        enabled=enabled,
+                        stages=OrderedDict(),
+                        plugins=OrderedDict(),
+                        started=(time.perf_counter(), time.process_time()),
+                        )
+
+    @contextmanager
+    def stage(self, name):
+        """Time the body of a with statement as the named stage, adding to
+        any time already recorded for the same stage."""
+        if not self.enabled:
+            yield
+            return
+
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            timing = self.stages.setdefault(name, [0.0, 0.0])
+            timing[0] += time.perf_counter() - wall
+            timing[1] += time.process_time() - cpu
+
+    def plugin_timings(self):
+        """Return the mapping of plugin names to lists of [wall time, cpu
+        time, conversations] to be filled in by the Dispatcher, or None when
+        profiling is disabled."""
+        return self.plugins if self.enabled else None
+
+    def report(self, parser):
+        """Return a dictionary of everything recorded during the run, along
+        with the given LogParser's line counts.  Parsing speed is based on the
+        time spent parsing log files within every process, which excludes any
+        time spent by plugins when parsing and processing are interleaved."""
+        wall = time.perf_counter() - self.started[0]
+        cpu = time.process_time() - self.started[1]
+        peak, children_peak = peak_memory()
+
+        lines = parser.matched + parser.unmatched
+        parse_time = parser.parse_time
+
+        resolver_stats = resolver().stats()
+        for table in resolver_stats.values():
+            lookups = table['hits'] + table['misses']
+            table['hit_rate'] = table['hits'] / lookups if lookups else None
+
+        return {
+            'total': {
+                'wall': wall,
+                'cpu': cpu,
+                'children_cpu': child_cpu_time(),
+            },
+            'stages': OrderedDict(
+                (name, {'wall': wall, 'cpu': cpu})
+                for name, (wall, cpu) in self.stages.items()),
+            'plugins': OrderedDict(
+                (name, {'wall': wall, 'cpu': cpu,
+                        'conversations': conversations})
+                for name, (wall, cpu, conversations)
+                in self.plugins.items()),
+            'parse': {
+                'lines': lines,
+                'seconds': parse_time,
+                'matched': parser.matched,
+                'unmatched': parser.unmatched,
+                'lines_per_sec': lines / parse_time if parse_time else None,
+            },
+            'resolver': resolver_stats,
+            'memory': {
+                'peak_rss_bytes': peak,
+                'peak_children_rss_bytes': children_peak,
+            },
+        }
+
+    def save(self, report, output_path):
+        """Write the report as JSON to the output path, and summarize it in
+        the log."""
+        file_path = path.join(output_path, 'ircstat.profile.json')
+        with atomic_write(file_path) as fh:
+            json.dump(report, fh, indent=1)
+
+        self.summarize(report)
+        log.info('wrote profile to "%s"', file_path)
+
+    @staticmethod
+    def summarize(report):
+        """Log a short human readable summary of the report."""
+        total = report['total']
+        log.info('profile: %.2fs wall, %.2fs cpu', total['wall'],
+                 total['cpu'])
+
+        for name, timing in report['stages'].items():
+            log.info('  stage %-20s %8.2fs wall %8.2fs cpu', name,
+                     timing['wall'], timing['cpu'])
+
+        for name, timing in report['plugins'].items():
+            log.info('  plugin %-19s %8.2fs wall %8.2fs cpu', name,
+                     timing['wall'], timing['cpu'])
+
+        parse = report['parse']
+        if parse['lines_per_sec'] is not None:
+            log.info('  parsed %d lines (%d unmatched), %.0f lines/s',
+                     parse['lines'], parse['unmatched'],
+                     parse['lines_per_sec'])
+
+        for name, table in report['resolver'].items():
+            if table['hit_rate'] is not None:
+                log.info('  %s cache: %.1f%% hits, %d entries', name,
+                         table['hit_rate'] * 100, table['size'])
+
+        peak = report['memory']['peak_rss_bytes']
+        if peak is not None:
+            log.info('  peak memory: %.1f MB', peak / 1048576.0)
@@ -0,0 +1,84 @@
+# Copyright 2013 John Reese
+# Licensed under the MIT license
+
+import datetime
+
+
+def date_range(first, last):
+    """Return a list of every date from first to last, inclusive."""
+    days = (last - first).days + 1
+    return [first + datetime.timedelta(days=n) for n in range(days)]
+
+
+def logged_days(network):
+    """Return a tuple of the first and last dates with statistics in any
+    channel of the network, or (None, None) if there are none."""
+    channels = [channel.days for channel in network.channels.values()
+                if channel.days]
+    if not channels:
+        return None, None
+
+    return (min(min(days) for days in channels),
+            max(max(days) for days in channels))
+
+
+def recent_dates(network, days):
+    """Return a list of up to the given number of dates, ending with the most
+    recent date with statistics in the network, and starting no earlier than
+    the first date with statistics."""
+    first, last = logged_days(network)
+    if last is None:
+        return []
+
+    first = max(first, last - datetime.timedelta(days=days - 1))
+    return date_range(first, last)
+
+
+def day_values(days, keys, dates):
+    """Given a mapping of dates to daily statistics, return an array with a
+    row for each of the given dates and a column for each of the given keys,
+    where dates without statistics are filled with zeros."""
+    import numpy as np
+
+    values = np.zeros((len(dates), len(keys)))
+
+    for row, date in enumerate(dates):
+        day = days.get(date)
+        if day is not None:
+            stats = day.stats
+            values[row] = [stats.get(key, 0) for key in keys]
+
+    return values
+
+
+def resample(dates, values, bucket):
+    """Sum consecutive rows of values into periods, where the given bucket
+    function maps each date to its period, such as lib.week or lib.month.
+    Returns a tuple of the list of periods and the summed array."""
+    import numpy as np
+
+    if not dates:
+        return [], values
+
+    periods = [bucket(date) for date in dates]
+    starts = [0] + [row for row in range(1, len(periods))
+                    if periods[row] != periods[row - 1]]
+
+    return ([periods[row] for row in starts],
+            np.add.reduceat(values, starts, axis=0))
+
+
+def rolling_mean(values, window):
+    """Return the trailing mean of each row of values over the given number
+    of rows, with NaN for rows before a full window is available."""
+    import numpy as np
+
+    sums = np.cumsum(values, axis=0)
+    means = np.full(values.shape, np.nan)
+
+    if len(values) >= window:
+        means[window - 1:] = sums[window - 1:]
+        means[window:] -= sums[:-window]
+        means[window - 1:] /= window
+
+    return means
@@ -0,0 +1,368 @@
+# Copyright 2013 John Reese
+# Licensed under the MIT license
+
+import hashlib
+import heapq
+import math
+import operator
+
+from array import array
+from functools import lru_cache
+
+from .ent import Struct
+
+
+@lru_cache(maxsize=65536)
+def hash64(value):
+    """Return a 64 bit hash of a string that, unlike hash(), is the same in
+    every process, so that sketches from worker processes and from earlier
+    runs can be merged."""
+    digest = hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+# the Mersenne prime 2 ** 61 - 1, used to hash values once for each row
+MERSENNE_61 = (1 << 61) - 1
+
+
+@lru_cache()
+def row_hashes(depth):
+    """Return a list of (a, b) pairs, one for each of depth rows, picking
+    independent hash functions (a * x + b) mod 2 ** 61 - 1 that are the same
+    in every process."""
+    return [(hash64('row %d a' % row) % (MERSENNE_61 - 1) + 1,
+             hash64('row %d b' % row) % MERSENNE_61)
+            for row in range(depth)]
+
+
+class HyperLogLog(Struct):
+    """Estimate the number of distinct strings added, using a fixed amount of
+    memory no matter how many strings are seen.  Each string's hash picks one
+    of 2 ** precision registers, which keeps the largest number of leading
+    zero bits seen in the rest of the hash.  Estimates have a relative
+    standard error of 1.04 / sqrt(2 ** precision), or about 1.6% with the
+    default precision of 12, using 4 KB per sketch.
+
+    Sketches that have seen few strings store only the registers that have
+    been set, as a list of encoded (register, rank) entries, and switch to a
+    dense array of every register once that would take less memory.  Two
+    sketches with the same precision can be merged, giving the same sketch as
+    if every string had been added to one of them."""
+
+    # bits used to store the rank in each sparse entry
+    rank_bits = 6
+
+    # bias correction constants for the smallest numbers of registers
+    alphas = {16: 0.673, 32: 0.697, 64: 0.709}
+
+    def __init__(self, precision=12):
+        if not 4 <= precision <= 16:
+            raise ValueError('HyperLogLog precision must be between 4 and 16, '
+                             'not %r' % precision)
+
+        Struct.__init__(self,
+                        precision=precision,
+                        sparse=array('I'),
+                        dense=None,
+                        )
+
+    def __repr__(self):
+        return '<%s precision=%d ~%d>' % (self.__class__.__name__,
+                                          self.precision, self.count())
+
+    @property
+    def size(self):
+        """The number of registers."""
+        return 1 << self.precision
+
+    @property
+    def error(self):
+        """The relative standard error of the estimated count."""
+        return 1.04 / math.sqrt(self.size)
+
+    def entry(self, value):
+        """Return the encoded (register, rank) entry for a string."""
+        bits = 64 - self.precision
+        hashed = hash64(value)
+        register = hashed >> bits
+        rank = bits - (hashed & ((1 << bits) - 1)).bit_length() + 1
+        return (register << self.rank_bits) | rank
+
+    def add(self, value):
+        """Add a single string to the sketch."""
+        self.update((value,))
+
+    def update(self, values):
+        """Add an iterable of strings to the sketch."""
+        entries = [self.entry(value) for value in values]
+
+        if self.dense is None:
+            self.sparse.extend(entries)
+            self.compact()
+        else:
+            self.raise_registers(self.dense, entries)
+
+    def compact(self):
+        """Remove duplicate sparse entries, and switch to dense registers once
+        the sparse entries would use more memory."""
+        if len(self.sparse) * self.sparse.itemsize <= self.size:
+            return
+
+        self.sparse = array('I', sorted(set(self.sparse)))
+        if len(self.sparse) * self.sparse.itemsize > self.size:
+            entries = self.sparse
+            self.sparse = array('I')
+            self.dense = bytearray(self.size)
+            self.raise_registers(self.dense, entries)
+
+    def raise_registers(self, registers, entries):
+        """Raise each register to the rank of any encoded entry for it."""
+        mask = (1 << self.rank_bits) - 1
+
+        for entry in entries:
+            register = entry >> self.rank_bits
+            rank = entry & mask
+            if rank > registers[register]:
+                registers[register] = rank
+
+    def merge(self, other):
+        """Add every string counted by another sketch to this one."""
+        if other.precision != self.precision:
+            raise ValueError('cannot merge HyperLogLog sketches with '
+                             'different precisions')
+
+        if other.dense is not None:
+            if self.dense is None:
+                entries = self.sparse
+                self.sparse = array('I')
+                self.dense = bytearray(other.dense)
+                self.raise_registers(self.dense, entries)
+            else:
+                self.dense = bytearray(map(max, self.dense, other.dense))
+        elif self.dense is None:
+            self.sparse.extend(other.sparse)
+            self.compact()
+        else:
+            self.raise_registers(self.dense, other.sparse)
+
+    def copy(self):
+        """Return an independent copy of the sketch."""
+        sketch = HyperLogLog(self.precision)
+        sketch.sparse = array('I', self.sparse)
+        if self.dense is not None:
+            sketch.dense = bytearray(self.dense)
+        return sketch
+
+    def registers(self):
+        """Return the full set of registers, even for a sparse sketch."""
+        if self.dense is not None:
+            return self.dense
+
+        registers = bytearray(self.size)
+        self.raise_registers(registers, self.sparse)
+        return registers
+
+    def count(self):
+        """Return the estimated number of distinct strings added."""
+        registers = self.registers()
+        size = self.size
+
+        zeros = registers.count(0)
+        if zeros == size:
+            return 0
+
+        alpha = self.alphas.get(size, 0.7213 / (1 + 1.079 / size))
+
+        estimate = alpha * size * size / sum(2.0 ** -r for r in registers)
+
+        # linear counting is more accurate for small numbers of strings
+        if estimate <= 2.5 * size and zeros:
+            estimate = size * math.log(size / zeros)
+
+        return int(round(estimate))
+
+    def summary(self):
+        """Return a plain dictionary of the estimated count and its relative
+        standard error."""
+        return {'distinct': self.count(), 'error': self.error}
+
+
+class CountMinSketch(Struct):
+    """Estimate how many times each string was counted, along with the most
+    frequent strings, using a fixed amount of memory no matter how many
+    distinct strings are seen.  Each string's hash picks one counter in each
+    of depth rows of width counters, and its estimate is the smallest of
+    those counters.  Estimates are never too low, and with probability
+    1 - e ** -depth are too high by at most e / width of the total count,
+    or about 0.27% with the default width of 1024 and 98% certainty with the
+    default depth of 4, using 16 KB per sketch.
+
+    The size most frequent strings are tracked as heavy hitters, replacing
+    the least frequent candidate whenever another string's estimate grows
+    beyond it, and re-estimating the candidates of both sketches on merges.
+
+    Sketches that have seen few distinct strings keep exact counts instead,
+    and switch to counters once the exact counts would use more memory.  Two
+    sketches with the same width and depth can be merged."""
+
+    # rough number of bytes used by each exact count
+    exact_entry_bytes = 100
+
+    def __init__(self, width=1024, depth=4, size=50):
+        if width < 1 or depth < 1 or size < 1:
+            raise ValueError('Count-Min sketch width, depth and size must be '
+                             'positive')
+
+        Struct.__init__(self,
+                        width=width,
+                        depth=depth,
+                        size=size,
+                        total=0,
+                        exact={},
+                        counters=None,
+                        top={},
+                        floor=0,
+                        )
+
+    def __repr__(self):
+        return '<%s %dx%d total=%d>' % (self.__class__.__name__, self.width,
+                                        self.depth, self.total)
+
+    @property
+    def error(self):
+        """The largest overestimate, as a fraction of the total count, with
+        probability 1 - e ** -depth."""
+        return math.e / self.width
+
+    def cells(self, value):
+        """Return the index of the counter for a string within each row."""
+        hashed = hash64(value)
+        width = self.width
+
+        return [row * width + (a * hashed + b) % MERSENNE_61 % width
+                for row, (a, b) in enumerate(row_hashes(self.depth))]
+
+    def update(self, counts):
+        """Add a mapping of strings to the number of times each was seen."""
+        self.total += sum(counts.values())
+
+        if self.counters is not None:
+            self.add_counts(counts)
+            return
+
+        exact = self.exact
+        for value, count in counts.items():
+            exact[value] = exact.get(value, 0) + count
+
+        limit = self.width * self.depth * 4 // self.exact_entry_bytes
+        if len(exact) > limit:
+            self.use_counters()
+
+    def use_counters(self):
+        """Switch from exact counts to counters."""
+        exact = self.exact
+        self.exact = {}
+        self.counters = array('I', bytes(4 * self.width * self.depth))
+        self.add_counts(exact)
+
+    def add_counts(self, counts):
+        """Add a mapping of strings to counts to the counters, offering each
+        string's new estimate to the heavy hitters."""
+        counters = self.counters
+
+        for value, count in counts.items():
+            estimate = None
+            for cell in self.cells(value):
+                counters[cell] += count
+                if estimate is None or counters[cell] < estimate:
+                    estimate = counters[cell]
+
+            self.offer(value, estimate)
+
+    def offer(self, value, estimate):
+        """Track a string as a heavy hitter, if its estimate is among the
+        largest."""
+        top = self.top
+
+        if value in top:
+            top[value] = estimate
+        elif len(top) < self.size:
+            top[value] = estimate
+            if len(top) == self.size:
+                self.floor = min(top.values())
+        elif estimate > self.floor:
+            lowest = min(top, key=top.get)
+            if estimate > top[lowest]:
+                del top[lowest]
+                top[value] = estimate
+            self.floor = min(top.values())
+
+    def estimate(self, value):
+        """Return the estimated number of times a string was counted."""
+        if self.counters is None:
+            return self.exact.get(value, 0)
+
+        counters = self.counters
+        return min(counters[cell] for cell in self.cells(value))
+
+    def most_common(self, count):
+        """Return a list of up to count (string, estimate) pairs for the most
+        frequent strings, most frequent first, with ties broken by string."""
+        if self.counters is None:
+            pairs = self.exact.items()
+        else:
+            pairs = [(value, self.estimate(value)) for value in self.top]
+
+        return [(value, -estimate) for estimate, value in
+                heapq.nsmallest(count, ((-estimate, value)
+                                        for value, estimate in pairs))]
+
+    def merge(self, other):
+        """Add every count from another sketch to this one."""
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError('cannot merge Count-Min sketches with different '
+                             'widths or depths')
+
+        if other.counters is None:
+            self.update(other.exact)
+            return
+
+        self.total += other.total
+
+        if self.counters is None:
+            exact = self.exact
+            self.exact = {}
+            self.counters = array('I', other.counters)
+            self.top = dict(other.top)
+            self.floor = other.floor
+            self.add_counts(exact)
+            return
+
+        self.counters = array('I', map(operator.add, self.counters,
+                                       other.counters))
+
+        candidates = set(self.top) | set(other.top)
+        self.top = {}
+        self.floor = 0
+        for estimate, value in heapq.nsmallest(
+                self.size, ((-self.estimate(value), value)
+                            for value in candidates)):
+            self.offer(value, -estimate)
+
+    def copy(self):
+        """Return an independent copy of the sketch."""
+        sketch = CountMinSketch(self.width, self.depth, self.size)
+        sketch.total = self.total
+        sketch.exact = dict(self.exact)
+        sketch.top = dict(self.top)
+        sketch.floor = self.floor
+        if self.counters is not None:
+            sketch.counters = array('I', self.counters)
+        return sketch
+
+    def summary(self):
+        """Return a plain dictionary of the total count, the largest
+        overestimate as a fraction of the total, and the estimated counts of
+        the most frequent strings."""
+        return {'total': self.total, 'error': self.error,
+                'top': dict(self.most_common(self.size))}
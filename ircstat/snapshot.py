@@ -0,0 +1,118 @@
+# Copyright 2013 John Reese
+# Licensed under the MIT license
+
+import os
+import pickle
+
+from collections import OrderedDict
+from os import path
+
+from .cache import CACHE_SETTINGS, settings_hash
+from .ent import Struct
+from .lib import atomic_write
+from .log import logger
+
+log = logger(__name__)
+
+# bump this whenever the format of saved snapshots changes
+SNAPSHOT_VERSION = 5
+
+# configuration values that affect the statistics gathered by plugins
+SNAPSHOT_SETTINGS = CACHE_SETTINGS + (
+    'filename_regex',
+    'filename_date_format',
+    'bots',
+    'plugins',
+    'plugin_blacklist',
+    'stats_backend',
+)
+
+
+class Snapshot(Struct):
+    """Save each plugin's aggregated statistics after a run, along with the
+    modification time and size of every log file that was processed, so that
+    later runs only need to process log files that are new or changed."""
+    def __init__(self, config, output_path):
+        Struct.__init__(self,
+                        path=path.join(output_path, 'ircstat.snapshot'),
+                        settings=settings_hash(config, SNAPSHOT_SETTINGS,
+                                               SNAPSHOT_VERSION),
+                        )
+
+    @staticmethod
+    def latest_logs(logs):
+        """Given a list of (file path, channel, date) tuples, return an ordered
+        mapping of (channel, date) to file path, where later files replace
+        earlier files for the same channel and date."""
+        return OrderedDict(((channel, date), file_path)
+                           for file_path, channel, date in logs)
+
+    @staticmethod
+    def fingerprint(file_path):
+        """Return a value that changes whenever the given file changes."""
+        st = os.stat(file_path)
+        return path.realpath(file_path), st.st_mtime_ns, st.st_size
+
+    def load(self, plugins):
+        """Return a tuple of (fingerprints, networks) from the saved snapshot,
+        or None if there is no usable snapshot for the current configuration
+        and set of plugins."""
+        if not path.isfile(self.path):
+            log.debug('no snapshot found at "%s"', self.path)
+            return None
+
+        try:
+            with open(self.path, 'rb') as fh:
+                settings, fingerprints, networks = pickle.load(fh)
+        except (OSError, EOFError, AttributeError, ValueError,
+                pickle.UnpicklingError):
+            log.warning('ignoring unreadable snapshot "%s"', self.path)
+            return None
+
+        if (settings != self.settings or
+                set(networks) != set(plugin.name for plugin in plugins)):
+            log.info('configuration changed since last snapshot, '
+                     'processing all log files')
+            return None
+
+        return fingerprints, networks
+
+    def save(self, fingerprints, plugin_stats):
+        """Save the given log file fingerprints and plugin statistics."""
+        networks = {plugin.name: network
+                    for plugin, network in plugin_stats.items()}
+        with atomic_write(self.path, 'wb') as fh:
+            pickle.dump((self.settings, fingerprints, networks), fh,
+                        pickle.HIGHEST_PROTOCOL)
+
+        log.debug('saved snapshot to "%s"', self.path)
+
+    def changes(self, logs, previous):
+        """Given the current set of log files, and the fingerprints from the
+        previous snapshot, return a tuple of (fingerprints, stale, fresh),
+        where stale is a list of (channel, date) that were changed or removed,
+        and fresh is a list of (file path, channel, date) tuples that are new
+        or changed and need to be processed."""
+        latest = self.latest_logs(logs)
+        fingerprints = {key: self.fingerprint(file_path)
+                        for key, file_path in latest.items()}
+
+        stale = [key for key in previous
+                 if fingerprints.get(key) != previous[key]]
+        fresh = [(file_path,) + key for key, file_path in latest.items()
+                 if previous.get(key) != fingerprints[key]]
+
+        return fingerprints, stale, fresh
+
+    def period_logs(self, logs, stale, fresh, period):
+        """Given the current set of log files, along with the stale days and
+        fresh log files from changes(), return a list of (file path, channel,
+        date) tuples for every other current day of a channel within the same
+        period as a stale day, where period is a function such as lib.month.
+        Plugins that can only remove whole periods process these again."""
+        periods = set((channel, period(date)) for channel, date in stale)
+        fresh = set((channel, date) for file_path, channel, date in fresh)
+
+        return [(file_path,) + key
+                for key, file_path in self.latest_logs(logs).items()
+                if key not in fresh and (key[0], period(key[1])) in periods]
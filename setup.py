@@ -18,12 +18,14 @@ setup(name='ircstat',
                    'Operating System :: OS Independent',
                    'Programming Language :: Python',
                    'Programming Language :: Python :: 3',
-                   'Programming Language :: Python :: 3.2',
-                   'Programming Language :: Python :: 3.3',
+                   'Programming Language :: Python :: 3.6',
+                   'Programming Language :: Python :: 3.7',
+                   'Programming Language :: Python :: 3.8',
                    'Topic :: Utilities',
                    'Development Status :: 2 - Pre-Alpha',
                    ],
       license='MIT License',
+      python_requires='>=3.6',
       install_requires=['matplotlib>=1.3.0',
                         'Jinja2>=2.6',
                         ],